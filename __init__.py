@@ -1,2 +1,17 @@
 from . import murapix
+from . import remap
+from . import pipeline
+from . import frame_stats
+from . import backends
+from . import led_simulation
+from . import recording
+from . import frame_server
+from . import render_process
+from . import gamepads
+from . import color_correction
+from . import text_cache
+from . import compositor
+from . import marquee
+from . import resolution
+from . import wall
 from . import custom_virtual_gamepads
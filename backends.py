@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Output backends of murapix.
+
+A backend is where the frames drawn on self.scratch go. The available
+backends are:
+    "hzeller": the LED panels, through hzeller rpi-rgb-led-matrix binding
+    "demo": a window on the standart screen, scaled by the demo factor
+    "null": nowhere, the frames are only remapped. The game runs as fast as
+        it can, e.g. for soak tests on any linux machine
+    "record": same as "null", the remapped frames being kept in memory and
+        optionally recorded to a file playable by player.py
+    "wall": the nodes of a wall of several murapix controllers, listed in
+        the [nodes] section of the config file, see wall.py
+
+The backend is selected with --backend=NAME on the command line, or with the
+backend option of the [output] section of the config file. By default it is
+"demo" with --demo, else "hzeller". The heavy imports of a backend (e.g. the
+rgbmatrix binding) are only done when it is selected.
+
+New backends are added with the register_backend decorator.
+"""
+import os
+import sys
+from collections import deque
+from time import perf_counter
+import pygame
+try:
+    from .remap import ChainFrame
+except (ImportError, SystemError) as e:#if doing screen test
+    from remap import ChainFrame
+try:
+    from .recording import FrameRecorder
+except (ImportError, SystemError) as e:#if doing screen test
+    from recording import FrameRecorder
+
+
+CURRDIR = os.path.abspath(os.path.dirname(__file__))
+
+BACKENDS = {}
+
+
+def register_backend(name):
+    """
+    Class decorator registering an output backend under name
+    """
+    def register(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return register
+
+
+def get_backend(name):
+    """
+    Returns the backend class registered under name
+    """
+    try:
+        return BACKENDS[name]
+    except KeyError:
+        raise ValueError('Unknown backend "{}", available backends: {}'.format(
+            name, ', '.join(sorted(BACKENDS))))
+
+
+def init_pygame_display(width, height):
+  os.putenv('SDL_VIDEODRIVER', 'fbcon')
+  os.environ["SDL_VIDEODRIVER"] = "dummy"
+  pygame.init()
+  #pygame.display.set_mode((width, height), 0, 24)
+  #return pygame.display.get_surface()
+  return pygame.Surface((width, height))
+
+
+class Backend:
+    """
+    Base class of the output backends.
+
+    murapix: the Murapix instance drawing the frames
+    options: dict of the options of the [output] section of the config file
+
+    Backend has the following class attributes:
+        uncapped: True if the game loop should not wait for the next frame
+        threadsafe: True if draw may be called from the pipeline thread
+        scalable: True if draw takes a scratch surface drawn at a lower
+            resolution, see Murapix.dynamic_resolution
+    """
+    name = None
+    uncapped = False
+    threadsafe = True
+    scalable = False
+
+    def __init__(self, murapix, options=None):
+        self.murapix = murapix
+        self.options = options or {}
+
+    def open(self):
+        """
+        Sets up the output, called once by Murapix.__init__
+        """
+        pass
+
+    def draw(self, scratch=None):
+        """
+        Outputs scratch, self.murapix.scratch by default
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+@register_backend('hzeller')
+class HzellerBackend(Backend):
+    scalable = True
+
+    def open(self):
+        murapix = self.murapix
+        #must be a raspberry pi configured for murapix, hence nodename
+        #must be "rpi-murapix"
+        if os.uname().nodename not in murapix.murapix_hosts:
+            raise EnvironmentError("Not a murapix, please select demo mode with --demo=X")
+        sys.path.append(os.path.join(CURRDIR, 'matrix','bindings','python'))
+        from rgbmatrix import RGBMatrix, RGBMatrixOptions
+
+        parallel = murapix.parallel
+        max_number_of_panels = murapix.max_number_of_panels
+        led_rows = murapix.led_rows
+        led_cols = murapix.led_cols
+        print('Going on the Murapix!')
+        print('{0} channel(s) of [{1}*{2}={3} LED] X [{4} LED]'.format(parallel,
+                                                 max_number_of_panels//parallel,
+                                                 led_cols,
+                                                 max_number_of_panels*led_cols//parallel,
+                                                 led_rows))
+        #the screen is just a single line of panels
+
+        options = RGBMatrixOptions()
+        options.rows = led_rows
+        options.cols = led_cols
+        options.parallel = parallel
+        options.chain_length = max_number_of_panels//parallel
+        options.hardware_mapping = 'regular'
+        options.drop_privileges = 0
+        murapix.matrix = RGBMatrix(options = options)
+
+        murapix.double_buffer = murapix.matrix.CreateFrameCanvas()
+        init_pygame_display(*murapix.remap.size)
+        #the chain surface writes directly in a preallocated RGB buffer
+        murapix.frame = ChainFrame(murapix.remap.size)
+        murapix._screen = murapix.frame.surface
+
+    def draw(self, scratch=None):
+        self.murapix.draw_murapix(scratch)
+
+
+@register_backend('demo')
+class DemoBackend(Backend):
+    #the display must be updated from the main thread
+    threadsafe = False
+
+    def open(self):
+        murapix = self.murapix
+        if not murapix.demo:
+            murapix.demo = 1
+        demo = murapix.demo
+        print('Going on the standart screen...')
+        pygame.init()
+        murapix._screen = pygame.display.set_mode((murapix.width*demo,
+                                                   murapix.height*demo),0, 32)
+
+    def draw(self, scratch=None):
+        self.murapix.draw_demo(scratch)
+
+
+@register_backend('null')
+class NullBackend(Backend):
+    uncapped = True
+    scalable = True
+
+    def open(self):
+        murapix = self.murapix
+        print('Going nowhere, headless...')
+        init_pygame_display(*murapix.remap.size)
+        murapix.frame = ChainFrame(murapix.remap.size)
+        murapix._screen = murapix.frame.surface
+        self.frames = 0
+
+    def draw(self, scratch=None):
+        murapix = self.murapix
+        if scratch is None:
+            scratch = murapix.scratch
+        t0 = perf_counter()
+        murapix.remap_frame(scratch)
+        murapix.stats.record('remap', perf_counter()-t0)
+        self.frames += 1
+
+
+@register_backend('record')
+class RecordingBackend(NullBackend):
+    """
+    Keeps the last record-frames remapped frames (100 by default) in
+    self.recorded, as bytes in the hzeller chain layout. If record-path is
+    set, every frame is also recorded to that file, see recording.py.
+    """
+    def open(self):
+        super().open()
+        self.recorded = deque(maxlen=int(self.options.get('record-frames', 100)))
+        path = self.options.get('record-path')
+        self._recorder = None
+        if path:
+            self._recorder = FrameRecorder(path, self.murapix.remap.size,
+                                           int(self.options.get('record-fps', 15)))
+
+    def draw(self, scratch=None):
+        super().draw(scratch)
+        if self.recorded.maxlen:
+            self.recorded.append(bytes(self.murapix.frame.buffer))
+        if self._recorder is not None:
+            self._recorder.write(self.murapix.frame)
+
+    def close(self):
+        if self._recorder is not None:
+            self._recorder.close()
+            self._recorder = None
+
+
+@register_backend('wall')
+class WallBackend(Backend):
+    """
+    Sends each frame to the nodes of the wall, each one showing its own band
+    of the panels, in lockstep. With dirty detection, only the panels which
+    changed are sent.
+    """
+    def open(self):
+        try:
+            from .wall import WallCoordinator
+        except (ImportError, SystemError) as e:#if doing screen test
+            from wall import WallCoordinator
+        murapix = self.murapix
+        print('Going on the wall...')
+        init_pygame_display(*murapix.remap.size)
+        self.coordinator = WallCoordinator(murapix.configfile,
+                                           float(self.options.get('wall-timeout', 10)))
+
+    def draw(self, scratch=None):
+        murapix = self.murapix
+        if scratch is None:
+            scratch = murapix.scratch
+        areas = None
+        if murapix.dirty is not None:
+            panels = murapix.remap.panels
+            areas = [panels[k][2] for k in murapix.dirty.update(scratch)]
+        self.coordinator.present(scratch, areas, murapix.stats)
+
+    def close(self):
+        self.coordinator.close()
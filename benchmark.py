@@ -0,0 +1,256 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Headless benchmark of the murapix output pipeline.
+
+Murapix instances are built from synthetic configs with various panel sizes,
+grid shapes, holes and parallel chains. The LED output goes to the
+standin_rgbmatrix module and the demo output to SDL dummy video driver, so
+neither hardware nor display is needed.
+
+For each config, the throughput (calls per second) of draw_murapix,
+draw_murapix with color correction (with and without dithering),
+draw_murapix with dirty panels detection, draw_demo, get_config and
+get_largest_rect is measured. The filling of the scratch surface and
+draw_murapix are also measured with an 8 bit palettized scratch surface,
+next to the RGB ones, and the memory used by the surfaces of both paths is
+reported.
+
+How to use:
+    python benchmark.py [--output=bench.json] [--baseline=baseline.json]
+                        [--tolerance=0.2] [--repeat=100]
+
+The results are written to the output JSON file. If a baseline JSON file
+from a previous run is given, every throughput lower than the baseline by
+more than the tolerance is reported as a regression, and the exit code is 1.
+"""
+import contextlib
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from itertools import product
+
+os.environ["SDL_VIDEODRIVER"] = "dummy"
+CURRDIR = os.path.abspath(os.path.dirname(__file__))
+sys.path.insert(0, CURRDIR)
+import standin_rgbmatrix
+sys.modules['rgbmatrix'] = standin_rgbmatrix
+standin_rgbmatrix.HISTORY = 0
+
+import pygame
+from murapix import Murapix, get_config, get_largest_rect, get_largest_rect_add
+from murapix import _largest_rects
+from color_correction import ColorCorrection
+
+
+PANEL_SIZES = (32, 64)
+GRID_SHAPES = ((1, 6), (2, 3), (3, 4), (4, 6))
+HOLES = ('none', 'corners')
+PARALLEL = (1, 2, 3)
+
+
+class BenchMurapix(Murapix):
+    murapix_hosts = (os.uname().nodename,)
+
+
+def make_mapping(rows, cols, holes):
+    """
+    Returns the mapping string of a rows*cols grid of panels numbered from
+    left to right and top to bottom. holes is "none" or "corners" to leave
+    the top left and bottom right places empty.
+    """
+    empty = set()
+    if holes == 'corners' and rows*cols > 2:
+        empty = {(0, 0), (rows-1, cols-1)}
+    number = 0
+    lines = []
+    for i in range(rows):
+        line = []
+        for j in range(cols):
+            if (i, j) in empty:
+                line.append('.')
+            else:
+                number += 1
+                line.append(str(number))
+        lines.append(', '.join(line))
+    return '\n          '.join(lines), number
+
+
+def synthetic_configs():
+    """
+    Yields (name, config file content) for each synthetic config
+    """
+    for led, (rows, cols), holes, parallel in product(PANEL_SIZES, GRID_SHAPES,
+                                                      HOLES, PARALLEL):
+        mapping, number_of_panels = make_mapping(rows, cols, holes)
+        if number_of_panels % parallel:
+            continue
+        name = '{0}x{1}_led{2}_holes-{3}_parallel{4}'.format(rows, cols, led,
+                                                             holes, parallel)
+        content = ("[matrix]\n"
+                   "mapping = {0}\n"
+                   "led-rows = {1}\n"
+                   "led-cols = {1}\n"
+                   "parallel = {2}\n").format(mapping, led, parallel)
+        yield name, content
+
+
+def throughput(function, repeat):
+    """
+    Returns the number of calls per second of function
+    """
+    function()#warm up
+    start = time.perf_counter()
+    for _ in range(repeat):
+        function()
+    elapsed = time.perf_counter()-start
+    return repeat/elapsed if elapsed else float('inf')
+
+
+def fill_noise(surface):
+    """
+    Fills surface with a pattern so that the blits are not trivial
+    """
+    width, height = surface.get_size()
+    for x in range(0, width, 8):
+        surface.fill(((x*7) % 256, (x*13) % 256, (x*29) % 256),
+                     (x, 0, 8, height))
+
+
+def noise_palette(surface):
+    """
+    Returns the colors fill_noise draws surface with, at most 256
+    """
+    width = surface.get_width()
+    return [((x*7) % 256, (x*13) % 256, (x*29) % 256)
+            for x in range(0, width, 8)][:256]
+
+
+def surface_bytes(surface):
+    return surface.get_pitch()*surface.get_height()
+
+
+def bench_config(configfile, repeat):
+    results = {}
+    results['get_config'] = throughput(lambda: get_config(configfile), repeat)
+    mapping = get_config(configfile)[0]
+    #without the cache, to measure the solver itself
+    def largest_rect(key):
+        _largest_rects.cache_clear()
+        get_largest_rect(mapping, key=key)
+    results['get_largest_rect'] = throughput(lambda: largest_rect('surface'),
+                                             repeat)
+    results['get_largest_rect_diag'] = throughput(lambda: largest_rect('diag'),
+                                                  repeat)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        led = BenchMurapix(['benchmark.py', configfile])
+        demo = BenchMurapix(['benchmark.py', configfile, '--demo=2'])
+    fill_noise(led.scratch)
+    fill_noise(demo.scratch)
+    results['draw_murapix'] = throughput(led.draw_murapix, repeat)
+    results['draw_demo'] = throughput(demo.draw_demo, repeat)
+    led.color = ColorCorrection(led.remap.size, gamma=2.2,
+                                white_balance=(255, 220, 200))
+    results['draw_murapix_color'] = throughput(led.draw_murapix, repeat)
+    led.color = ColorCorrection(led.remap.size, gamma=2.2, dithering=True)
+    results['draw_murapix_dither'] = throughput(led.draw_murapix, repeat)
+    led.color = None
+
+    #one panel-sized square moving around, as most frames of screen_test
+    led.dirty_detection = 'auto'
+    led.start_dirty_detection()
+    (left, top), (width, height) = get_largest_rect_add(led.led_rows, mapping)
+    position = [0]
+    def draw_dirty():
+        position[0] = (position[0]+1) % max(1, width-led.led_cols)
+        led.scratch.fill((255, 0, 0), (left+position[0], top,
+                                        led.led_cols//2, led.led_rows//2))
+        led.draw_murapix()
+    results['draw_murapix_dirty'] = throughput(draw_dirty, repeat)
+    led.dirty_detection = None
+    led.start_dirty_detection()
+
+    #the same frames on an 8 bit scratch surface
+    memory = {'scratch_rgb': surface_bytes(led.scratch),
+              'frame_rgb': len(led.frame.buffer)}
+    results['fill_scratch'] = throughput(lambda: fill_noise(led.scratch), repeat)
+    led.set_palette(noise_palette(led.scratch))
+    results['fill_scratch_palette'] = throughput(lambda: fill_noise(led.scratch),
+                                                 repeat)
+    results['draw_murapix_palette'] = throughput(led.draw_murapix, repeat)
+    memory['scratch_palette'] = surface_bytes(led.scratch)
+    #the indices, then the RGB frame they are expanded into
+    memory['frame_palette'] = len(led.indexed.buffer)+len(led.frame.buffer)
+    return results, memory
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns the list of (config, metric, baseline, result) where the result
+    is lower than the baseline by more than tolerance
+    """
+    regressions = []
+    for name, metrics in baseline.get('configs', {}).items():
+        for metric, reference in metrics.items():
+            value = results['configs'].get(name, {}).get(metric)
+            if value is not None and value < reference*(1-tolerance):
+                regressions.append((name, metric, reference, value))
+    return regressions
+
+
+def process_bench_args(argv):
+    args = {'output': 'bench.json', 'baseline': None,
+            'tolerance': 0.2, 'repeat': 100}
+    for arg in argv[1:]:
+        assert arg.startswith('--') and '=' in arg, "unknown argument "+arg
+        key, value = arg[2:].split('=', 1)
+        assert key in args, "unknown argument "+arg
+        args[key] = value
+    args['tolerance'] = float(args['tolerance'])
+    args['repeat'] = int(args['repeat'])
+    return args
+
+
+def main():
+    args = process_bench_args(sys.argv)
+    pygame.init()
+    results = {'python': sys.version.split()[0],
+               'pygame': pygame.version.ver,
+               'repeat': args['repeat'],
+               'configs': {},
+               'memory': {}}
+    with tempfile.TemporaryDirectory() as tmp:
+        for name, content in synthetic_configs():
+            configfile = os.path.join(tmp, name+'.ini')
+            with open(configfile, 'w') as f:
+                f.write(content)
+            metrics, memory = bench_config(configfile, args['repeat'])
+            results['configs'][name] = metrics
+            results['memory'][name] = memory
+            print(name, ' '.join('{}={:.0f}/s'.format(k, v)
+                                 for k, v in metrics.items()),
+                  ' '.join('{}={}B'.format(k, v) for k, v in memory.items()))
+    with open(args['output'], 'w') as f:
+        json.dump(results, f, indent=2)
+    print('results written to', args['output'])
+
+    if args['baseline']:
+        with open(args['baseline']) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args['tolerance'])
+        for name, metric, reference, value in regressions:
+            print('REGRESSION {} {}: {:.0f}/s, baseline {:.0f}/s'.format(name,
+                                                                         metric,
+                                                                         value,
+                                                                         reference))
+        if regressions:
+            sys.exit(1)
+        print('no regression against', args['baseline'])
+
+
+if __name__ == '__main__':
+    main()
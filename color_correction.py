@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Color correction of the frames sent to the LED panels.
+
+LEDs are linear: without gamma correction, dark colors look washed out, and
+the white of a given installation is rarely white. Rather than each game
+correcting its colors, ColorCorrection maps every remapped frame through a
+precomputed table of 256 entries per channel (gamma, white balance and
+brightness all folded in), in a single vectorized pass over the chain frame,
+just before it is handed to the canvas.
+
+With dithering, the table keeps 8 more bits of precision, and an ordered
+2x2 threshold pattern, shifted every frame, decides whether each LED is
+rounded up or down. Over 4 frames, each LED shows the average of the exact
+corrected value, which recovers the dark shades lost by the gamma curve.
+
+The brightness may be changed at runtime: only the table is rebuilt, once.
+"""
+
+try:
+    from .remap import ChainFrame
+except (ImportError, SystemError) as e:#if doing screen test
+    from remap import ChainFrame
+
+
+#2x2 ordered dithering thresholds, in 1/256 of a level
+BAYER = ((32, 160), (224, 96))
+
+
+class ColorCorrection:
+    """
+    size: (width, height) of the chain frames
+    gamma: gamma of the LEDs, 1 for no correction
+    white_balance: (red, green, blue) values shown for white, 255 being the
+        full intensity of the channel
+    brightness: in percent, see set_brightness
+    dithering: True to use temporal dithering
+
+    ColorCorrection has the following properties:
+        self.frame: the ChainFrame the corrected frames are written into
+        self.brightness: the current brightness in percent
+    """
+    def __init__(self, size, gamma=1., white_balance=(255, 255, 255),
+                 brightness=100, dithering=False):
+        import numpy as np
+        assert gamma > 0, "gamma must be positive"
+        assert len(white_balance) == 3, "white_balance must be (red, green, blue)"
+        assert all(0 <= c <= 255 for c in white_balance), "white_balance values must be in 0..255"
+        self.size = tuple(size)
+        self.gamma = gamma
+        self.white_balance = tuple(white_balance)
+        self.dithering = dithering
+        self.frame = ChainFrame(self.size)
+        width, height = self.size
+        #index of (value, channel) in the table: value+256*channel
+        self._offsets = np.array([0, 256, 512], dtype=np.uint16)
+        self._index = np.empty((height, width, 3), dtype=np.uint16)
+        self._lut = None
+        self._phase = 0
+        if dithering:
+            self._scaled = np.empty((height, width, 3), dtype=np.uint16)
+            bayer = np.array(BAYER, dtype=np.uint16)
+            self._thresholds = []
+            for dy, dx in ((0, 0), (1, 1), (0, 1), (1, 0)):
+                #each LED goes through the 4 thresholds in 4 frames
+                pattern = np.roll(bayer, (dy, dx), axis=(0, 1))
+                tiled = np.tile(pattern, ((height+1)//2, (width+1)//2))[:height, :width]
+                self._thresholds.append(np.repeat(tiled[:, :, None], 3, axis=2))
+        self.set_brightness(brightness)
+
+    def set_brightness(self, brightness):
+        """
+        brightness: in percent, from 0 to 100. Rebuilds the table, nothing
+        else, so it may be changed as often as needed.
+        """
+        import numpy as np
+        assert 0 <= brightness <= 100, "brightness must be in 0..100"
+        self.brightness = brightness
+        levels = (np.arange(256)/255.)**self.gamma
+        white = np.array(self.white_balance)*brightness/100.
+        #(channel, value) to the corrected value
+        corrected = white[:, None]*levels[None, :]
+        if self.dithering:
+            #8.8 fixed point, at most 255*256 so adding a threshold fits
+            lut = np.floor(corrected*256).astype(np.uint16)
+        else:
+            lut = np.rint(corrected).astype(np.uint8)
+        self._lut = lut.reshape(-1)
+
+    def apply(self, frame, areas=None):
+        """
+        Writes the corrected frame into self.frame and returns it.
+
+        frame: ChainFrame as remapped from the scratch surface
+        areas: list of ((left, top), (width, height)) areas of the frame to
+            correct, by default the whole frame. With dithering, the whole
+            frame is always corrected.
+        """
+        import numpy as np
+        source = frame.array
+        target = self.frame.array
+        index = self._index
+        lut = self._lut
+        if self.dithering:
+            np.add(source, self._offsets, out=index)
+            scaled = self._scaled
+            np.take(lut, index, out=scaled, mode='clip')
+            np.add(scaled, self._thresholds[self._phase], out=scaled)
+            np.right_shift(scaled, 8, out=target, casting='unsafe')
+            self._phase = (self._phase+1) % len(self._thresholds)
+        elif areas is None:
+            np.add(source, self._offsets, out=index)
+            np.take(lut, index, out=target, mode='clip')
+        else:
+            for (left, top), (width, height) in areas:
+                y = slice(top, top+height)
+                x = slice(left, left+width)
+                np.add(source[y, x], self._offsets, out=index[y, x])
+                np.take(lut, index[y, x], out=target[y, x], mode='clip')
+        return self.frame
@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Layered composition of the murapix scratch surface.
+
+Most scenes are a static background with a few moving sprites on top.
+Rather than redrawing everything on self.scratch each frame, or erasing
+the sprites by hand, a game may draw on named layers, from bottom to top,
+each one being a surface of the size of self.scratch which keeps track of
+the areas drawn on it.
+
+Consecutive static layers (e.g. the background, or a frame drawn over the
+sprites) are flattened once into a cached surface, only rebuilt in the areas
+where they are drawn on again. Each frame, only the dirty areas of the
+layers are composited again into self.scratch, from the cached static
+surfaces and the dynamic layers, and reported as dirty to the murapix.
+
+The layers are drawn on through Layer.blit and Layer.erase, or directly on
+Layer.surface followed by Layer.mark_dirty.
+"""
+import pygame
+
+
+#transparent pixel of the layers
+CLEAR = (0, 0, 0, 0)
+
+
+def merge_rects(rects):
+    """
+    Returns the rects merged so that none of them overlap, overlapping rects
+    being replaced by their union
+    """
+    merged = []
+    for rect in rects:
+        rect = pygame.Rect(rect)
+        if not rect.width or not rect.height:
+            continue
+        #the union may overlap rects already merged
+        k = rect.collidelist(merged)
+        while k != -1:
+            rect.union_ip(merged.pop(k))
+            k = rect.collidelist(merged)
+        merged.append(rect)
+    return merged
+
+
+class Layer:
+    """
+    name: name of the layer
+    size: (width, height) of the layer, the size of the scratch surface
+    static: True if the layer is seldom drawn on, it is then cached with
+        the static layers next to it
+    transparent: False if the layer is opaque, e.g. a background, which is
+        faster to composite
+
+    Layer has the following properties:
+        self.surface: the pygame surface of the layer
+        self.visible: True by default, set to False to hide the layer
+    """
+    def __init__(self, name, size, static=False, transparent=True):
+        self.name = name
+        self.static = static
+        self.transparent = transparent
+        if transparent:
+            self.surface = pygame.Surface(size, pygame.SRCALPHA)
+            self.surface.fill(CLEAR)
+        else:
+            self.surface = pygame.Surface(size)
+        self._visible = True
+        self._dirty = [self.surface.get_rect()]
+        #areas drawn with blit since the last erase
+        self._drawn = []
+
+    @property
+    def visible(self):
+        return self._visible
+
+    @visible.setter
+    def visible(self, visible):
+        if visible != self._visible:
+            self._visible = visible
+            self.mark_dirty(self.surface.get_rect())
+
+    def mark_dirty(self, rect):
+        """
+        Reports that the rect area of the layer changed
+        """
+        self._dirty.append(pygame.Rect(rect))
+
+    def blit(self, source, dest, area=None):
+        """
+        Same as surface.blit, marking the area drawn as dirty. It is
+        cleared by the next erase. Returns the pygame.Rect drawn.
+        """
+        rect = self.surface.blit(source, dest, area)
+        self._dirty.append(rect)
+        self._drawn.append(rect)
+        return rect
+
+    def erase(self):
+        """
+        Clears the areas drawn with blit since the last erase, e.g. to move
+        the sprites of the layer by erasing then blitting them again
+        """
+        for rect in self._drawn:
+            self.clear(rect)
+        self._drawn = []
+
+    def clear(self, rect=None):
+        """
+        Clears rect, by default the whole layer: transparent if the layer is
+        transparent, else black
+        """
+        if rect is None:
+            rect = self.surface.get_rect()
+            self._drawn = []
+        rect = self.surface.fill(CLEAR if self.transparent else (0, 0, 0), rect)
+        self._dirty.append(rect)
+
+    def take_dirty(self):
+        """
+        Returns the areas changed since the last call
+        """
+        dirty = self._dirty
+        self._dirty = []
+        return dirty
+
+
+class Compositor:
+    """
+    size: (width, height) of the scratch surface
+
+    Compositor has the following properties:
+        self.layers: the layers, from bottom to top
+        self.composited: the number of pixels composited into scratch on the
+            last frame
+    """
+    def __init__(self, size):
+        self.size = tuple(size)
+        self.layers = []
+        self.composited = 0
+        #list of (cached surface, static layers) or (None, [dynamic layer])
+        self._segments = None
+
+    def add_layer(self, name, static=False, transparent=True):
+        """
+        Adds a layer on top of the others and returns it, see Layer
+        """
+        if name in [layer.name for layer in self.layers]:
+            raise ValueError('There is already a layer named {}'.format(name))
+        layer = Layer(name, self.size, static, transparent)
+        self.layers.append(layer)
+        self._segments = None
+        return layer
+
+    def remove_layer(self, name):
+        self.layers.remove(self[name])
+        self._segments = None
+
+    def __getitem__(self, name):
+        for layer in self.layers:
+            if layer.name == name:
+                return layer
+        raise KeyError(name)
+
+    def _build_segments(self):
+        segments = []
+        for layer in self.layers:
+            if layer.static and segments and segments[-1][0] is not None:
+                segments[-1][1].append(layer)
+            elif layer.static:
+                #the bottom of the stack may be opaque
+                flags = pygame.SRCALPHA if segments else 0
+                segments.append((pygame.Surface(self.size, flags), [layer]))
+            else:
+                segments.append((None, [layer]))
+        self._segments = segments
+
+    def compose(self, scratch):
+        """
+        Composites the dirty areas of the layers into scratch. Returns the
+        list of pygame.Rect of scratch which changed.
+        """
+        rebuilt = self._segments is None
+        if rebuilt:
+            self._build_segments()
+        full = scratch.get_rect()
+        dirty = [full] if rebuilt else []
+        for cache, layers in self._segments:
+            if cache is None:
+                dirty.extend(layers[0].take_dirty())
+                continue
+            areas = [full] if rebuilt else []
+            for layer in layers:
+                areas.extend(layer.take_dirty())
+            #refresh the cache of the static layers where they changed
+            for rect in merge_rects(r.clip(full) for r in areas):
+                cache.fill(CLEAR if cache.get_flags() & pygame.SRCALPHA else (0, 0, 0),
+                           rect)
+                for layer in layers:
+                    if layer.visible:
+                        cache.blit(layer.surface, rect, rect)
+                dirty.append(rect)
+        dirty = merge_rects(r.clip(full) for r in dirty)
+        opaque = self._segments and self._segments[0][0] is not None
+        for rect in dirty:
+            if not opaque:
+                scratch.fill((0, 0, 0), rect)
+            for cache, layers in self._segments:
+                if cache is not None:
+                    scratch.blit(cache, rect, rect)
+                elif layers[0].visible:
+                    scratch.blit(layers[0].surface, rect, rect)
+        self.composited = sum(rect.width*rect.height for rect in dirty)
+        return dirty
@@ -0,0 +1,480 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Network frame ingest, so the murapix can be the remote display of a game
+rendered on another machine.
+
+FrameSender, on the rendering machine, sends tiles of its scratch surface:
+either the whole surface (a full frame) or only some areas of it, e.g. the
+panels which changed. Each message is a header followed by the raw RGB
+pixels of the tile, row after row:
+    - magic "MPXT", flags (END on the last tile of a frame), session of the
+      sender, sequence number of the frame, time it was sent (time.time()),
+      and x, y, width, height of the tile in the scratch surface.
+The session is drawn at random by each sender, so that a sender restarting
+its sequence numbers from 0 is not mistaken for late frames.
+Tiles are split so that each message fits in packet_size bytes, hence in a
+single UDP datagram. Over TCP the same messages are simply streamed. A frame
+without any change is a single empty tile.
+
+Over TCP, a display may also be driven in lockstep with others (see
+wall.py): it answers each frame with an ACK once ready to show it, and shows
+it when it receives a SWAP message.
+
+FrameServer, on the murapix, receives the tiles in a dedicated thread and
+decodes them straight into a preallocated back buffer. When the last tile of
+a frame arrives, the areas it changed are copied to the front buffer, from
+which Murapix blits them onto self.scratch before the frame is drawn through
+the normal remap/output path. The drop-late policy is:
+    - tiles of a frame older than the frame being received are dropped,
+    - frames received faster than they are displayed are merged, only the
+      newest one is shown,
+    - sequence numbers which never showed up are counted as lost.
+
+The whole path can be checked with a local sender on loopback, see
+loopback_test:
+    python3 frame_server.py --loopback
+"""
+import random
+import socket
+import struct
+import threading
+import time
+import pygame
+
+
+MAGIC = b'MPXT'
+HEADER = struct.Struct('<4sBIIdHHHH')
+END = 1
+SWAP = 2
+ACK_MAGIC = b'MPXA'
+#magic, sequence number of the frame ready to be shown
+ACK = struct.Struct('<4sI')
+DEFAULT_PORT = 5555
+#largest UDP payload not fragmented on ethernet
+UDP_PACKET = 1472
+TCP_PACKET = 65536
+SEQ_MASK = 0xffffffff
+
+
+def parse_address(address):
+    """
+    Returns (protocol, host, port) of an address such as "5555",
+    "udp:5555", "tcp:5555" or "udp:192.168.1.10:5555". The protocol is udp
+    and the host 0.0.0.0 by default.
+    """
+    parts = str(address).split(':')
+    protocol = 'udp'
+    if parts[0] in ('udp', 'tcp'):
+        protocol = parts.pop(0)
+    host = '0.0.0.0'
+    if len(parts) == 2:
+        host = parts.pop(0)
+    if len(parts) != 1:
+        raise ValueError('Address must be [udp:|tcp:][HOST:]PORT, got '+str(address))
+    port = int(parts[0]) if parts[0] else DEFAULT_PORT
+    return protocol, host, port
+
+
+def _newer(seq, than):
+    #serial number arithmetic, the sequence numbers wrap around
+    return 0 < ((seq-than) & SEQ_MASK) < 0x80000000
+
+
+def split_tile(rect, packet_size):
+    """
+    Yields the (x, y, width, height) pieces of rect whose pixels fit in a
+    message of packet_size bytes
+    """
+    x, y, width, height = pygame.Rect(rect)
+    pixels = max(1, (packet_size-HEADER.size)//3)
+    cols = min(width, pixels)
+    rows = max(1, pixels//cols)
+    for top in range(y, y+height, rows):
+        for left in range(x, x+width, cols):
+            yield (left, top,
+                   min(cols, x+width-left), min(rows, y+height-top))
+
+
+class FrameSender:
+    """
+    address: address of the murapix, see parse_address, e.g. "udp:rpi-murapix:5555"
+    size: (width, height) of the murapix scratch surface
+    packet_size: maximum size of a message, UDP_PACKET or TCP_PACKET by default
+    """
+    def __init__(self, address, size, packet_size=None):
+        protocol, host, port = parse_address(address)
+        self.protocol = protocol
+        self.size = tuple(size)
+        self.session = random.getrandbits(32)
+        self.seq = 0
+        self.sent = 0
+        if protocol == 'udp':
+            self.packet_size = packet_size or UDP_PACKET
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._socket.connect((host, port))
+        else:
+            self.packet_size = packet_size or TCP_PACKET
+            self._socket = socket.create_connection((host, port))
+            self._socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+
+    def send_frame(self, surface):
+        """
+        Sends the whole surface
+        """
+        self.send_tiles(surface, [((0, 0), self.size)])
+
+    def send_tiles(self, surface, rects):
+        """
+        Sends the rects areas of surface as one frame, e.g. the panels
+        which changed
+        """
+        assert surface.get_size() == self.size, "surface must be the size of the murapix"
+        pieces = [piece for rect in rects
+                  for piece in split_tile(rect, self.packet_size)]
+        sent = time.time()
+        if not pieces:
+            self._socket.sendall(HEADER.pack(MAGIC, END, self.session, self.seq,
+                                             sent, 0, 0, 0, 0))
+        for k, (x, y, width, height) in enumerate(pieces):
+            flags = END if k == len(pieces)-1 else 0
+            pixels = pygame.image.tostring(surface.subsurface((x, y, width, height)), 'RGB')
+            self._socket.sendall(HEADER.pack(MAGIC, flags, self.session, self.seq,
+                                             sent, x, y, width, height)+pixels)
+        self.seq = (self.seq+1) & SEQ_MASK
+        self.sent += 1
+
+    def wait_ack(self):
+        """
+        Over TCP, waits for the display to be ready to show a frame, and
+        returns the sequence number of that frame
+        """
+        data = b''
+        while len(data) < ACK.size:
+            chunk = self._socket.recv(ACK.size-len(data))
+            if not chunk:
+                raise ConnectionError("murapix display disconnected")
+            data += chunk
+        magic, seq = ACK.unpack(data)
+        if magic != ACK_MAGIC:
+            raise ConnectionError("unexpected answer from the murapix display")
+        return seq
+
+    def send_swap(self):
+        """
+        Over TCP, tells the display to show the last frame sent
+        """
+        self._socket.sendall(HEADER.pack(MAGIC, SWAP, self.session,
+                                         (self.seq-1) & SEQ_MASK,
+                                         time.time(), 0, 0, 0, 0))
+
+    def close(self):
+        self._socket.close()
+
+
+class FrameServer:
+    """
+    size: (width, height) of the murapix scratch surface
+    address: address to listen on, see parse_address
+
+    FrameServer has the following properties:
+        self.packets: the number of messages received
+        self.bytes: the number of bytes received
+        self.frames: the number of complete frames received
+        self.shown: the number of frames handed to the murapix by self.apply
+        self.late: the number of tiles dropped because a newer frame was
+            already being received
+        self.lost: the number of frames which never arrived
+        self.merged: the number of frames replaced by a newer one before
+            being shown
+        self.invalid: the number of malformed messages
+        self.restarts: the number of times a new sender session started
+        self.latency: seconds between the sending of the last shown frame and
+            its reception, only meaningful if both clocks are synchronized
+    """
+    def __init__(self, size, address=DEFAULT_PORT):
+        import numpy as np
+        width, height = size
+        self.size = (width, height)
+        self.protocol, host, port = parse_address(address)
+        self.packets = 0
+        self.bytes = 0
+        self.frames = 0
+        self.shown = 0
+        self.late = 0
+        self.lost = 0
+        self.merged = 0
+        self.invalid = 0
+        self.restarts = 0
+        self.latency = 0.
+        self.error = None
+        self._started = None
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._back = np.zeros((height, width, 3), dtype=np.uint8)
+        self._front_buffer = bytearray(width*height*3)
+        self._front = np.frombuffer(self._front_buffer, dtype=np.uint8).reshape(height, width, 3)
+        self._front_surface = pygame.image.frombuffer(self._front_buffer, self.size, 'RGB')
+        #areas of the back buffer received for the frame in progress
+        self._receiving = []
+        #areas of the front buffer not yet blitted by apply, and when the
+        #newest frame they belong to was sent and received
+        self._pending = []
+        self._pending_frames = 0
+        self._pending_times = None
+        self._session = None
+        self._seq = None
+        self._packet = bytearray(HEADER.size+max(UDP_PACKET, TCP_PACKET, width*3))
+        if self.protocol == 'udp':
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+        else:
+            self._socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._socket.bind((host, port))
+        #the port actually bound, e.g. when asking for port 0
+        self.port = self._socket.getsockname()[1]
+        self._socket.settimeout(0.1)
+        self._thread = threading.Thread(target=self._receive_loop,
+                                        name='murapix-ingest',
+                                        daemon=True)
+
+    def start(self):
+        if self.protocol == 'tcp':
+            self._socket.listen(1)
+        self._started = time.perf_counter()
+        self._thread.start()
+
+    def _receive_loop(self):
+        try:
+            if self.protocol == 'udp':
+                self._receive_datagrams()
+            else:
+                self._receive_streams()
+        except Exception as e:
+            if not self._stopping:
+                self.error = e
+                print("Error in murapix ingest thread")
+                print(e)
+
+    def _receive_datagrams(self):
+        packet = self._packet
+        view = memoryview(packet)
+        while not self._stopping:
+            try:
+                length = self._socket.recv_into(packet)
+            except socket.timeout:
+                continue
+            self._decode(view, length)
+
+    def _receive_streams(self):
+        view = memoryview(self._packet)
+        while not self._stopping:
+            try:
+                connection, _ = self._socket.accept()
+            except socket.timeout:
+                continue
+            connection.settimeout(0.1)
+            #a new connection is a new sender, its sequence starts again
+            self._restart(None)
+            with connection:
+                while not self._stopping:
+                    if not self._read_exactly(connection, view[:HEADER.size]):
+                        break
+                    width, height = HEADER.unpack_from(view)[-2:]
+                    length = HEADER.size+width*height*3
+                    if HEADER.unpack_from(view)[0] != MAGIC or length > len(view):
+                        #lost track of the messages in the stream
+                        self.invalid += 1
+                        break
+                    if not self._read_exactly(connection, view[HEADER.size:length]):
+                        break
+                    self._decode(view, length)
+
+    def _read_exactly(self, connection, view):
+        """
+        Reads len(view) bytes into view, returns False if the sender left
+        """
+        received = 0
+        while received < len(view):
+            if self._stopping:
+                return False
+            try:
+                n = connection.recv_into(view[received:])
+            except socket.timeout:
+                continue
+            if not n:
+                return False
+            received += n
+        return True
+
+    def _restart(self, session):
+        #tiles of a frame the previous sender did not end are dropped
+        if self._session is not None:
+            self.restarts += 1
+        self._session = session
+        self._seq = None
+        self._receiving = []
+
+    def _decode(self, view, length):
+        import numpy as np
+        self.packets += 1
+        self.bytes += length
+        if length < HEADER.size:
+            self.invalid += 1
+            return
+        magic, flags, session, seq, sent, x, y, width, height = HEADER.unpack_from(view)
+        if (magic != MAGIC or length != HEADER.size+width*height*3
+                or x+width > self.size[0] or y+height > self.size[1]):
+            self.invalid += 1
+            return
+        if flags & SWAP:
+            #only meaningful to the lockstep displays of wall.py
+            return
+        if session != self._session:
+            self._restart(session)
+        if self._seq is None or _newer(seq, self._seq):
+            if self._seq is not None:
+                self.lost += ((seq-self._seq) & SEQ_MASK)-1
+            self._seq = seq
+        elif seq != self._seq:
+            self.late += 1
+            return
+        pixels = np.frombuffer(view, dtype=np.uint8, count=width*height*3,
+                               offset=HEADER.size)
+        self._back[y:y+height, x:x+width] = pixels.reshape(height, width, 3)
+        self._receiving.append((x, y, width, height))
+        if flags & END:
+            self._commit(sent)
+
+    def _commit(self, sent):
+        #tiles of frames which did not end are committed with this one
+        with self._lock:
+            for x, y, width, height in self._receiving:
+                self._front[y:y+height, x:x+width] = self._back[y:y+height, x:x+width]
+            self._pending.extend(self._receiving)
+            self._pending_frames += 1
+            self._pending_times = (sent, time.time())
+            self.frames += 1
+        self._receiving = []
+
+    def apply(self, scratch):
+        """
+        Blits onto scratch the areas received since the last call.
+        Returns the list of pygame.Rect which changed.
+        """
+        if self.error is not None:
+            raise RuntimeError("murapix ingest thread stopped") from self.error
+        with self._lock:
+            if not self._pending_frames:
+                return []
+            rects = [pygame.Rect(rect) for rect in self._pending]
+            for rect in rects:
+                scratch.blit(self._front_surface, rect, rect)
+            self.merged += self._pending_frames-1
+            self.shown += 1
+            sent, received = self._pending_times
+            self._pending = []
+            self._pending_frames = 0
+        self.latency = received-sent
+        return rects
+
+    def throughput(self):
+        """
+        Returns a dict with the frames and megabytes received per second
+        since the start, and the counters of dropped frames
+        """
+        elapsed = max(1e-9, time.perf_counter()-self._started) if self._started else 0.
+        return {'frames/s': self.frames/elapsed if elapsed else 0.,
+                'MB/s': self.bytes/elapsed/1e6 if elapsed else 0.,
+                'frames': self.frames,
+                'shown': self.shown,
+                'late': self.late,
+                'lost': self.lost,
+                'merged': self.merged,
+                'invalid': self.invalid,
+                'restarts': self.restarts,
+                'latency ms': self.latency*1000}
+
+    def stop(self, timeout=1.0):
+        self._stopping = True
+        if self._thread.is_alive():
+            self._thread.join(timeout)
+        self._socket.close()
+
+
+def _wait_frames(server, frames, timeout=2.0):
+    deadline = time.perf_counter()+timeout
+    while server.frames < frames and time.perf_counter() < deadline:
+        time.sleep(0.001)
+    assert server.frames == frames, "frame {} never arrived".format(frames)
+
+
+def loopback_test(protocol='udp', size=(128, 64), frames=50):
+    """
+    Sends frames to a FrameServer from a local FrameSender, checking that
+    each one is shown as sent: full frames, tiles, an empty frame, then a
+    new sender starting its sequence numbers again. Raises AssertionError
+    on the first difference, else returns the throughput of the server.
+    """
+    server = FrameServer(size, '{}:127.0.0.1:0'.format(protocol))
+    server.start()
+    address = '{}:127.0.0.1:{}'.format(protocol, server.port)
+    source = pygame.Surface(size)
+    scratch = pygame.Surface(size)
+    width, height = size
+    received = 0
+    def check(sender, rects=None):
+        nonlocal received
+        if rects is None:
+            sender.send_frame(source)
+        else:
+            sender.send_tiles(source, rects)
+        received += 1
+        _wait_frames(server, received)
+        server.apply(scratch)
+        assert (pygame.image.tostring(scratch, 'RGB')
+                == pygame.image.tostring(source, 'RGB')), "frame {} differs".format(received)
+    try:
+        for session in range(2):
+            #a second sender, e.g. the game restarted, from sequence 0
+            sender = FrameSender(address, size)
+            try:
+                for k in range(frames if session == 0 else 5):
+                    source.fill((k*5 % 256, session*128, 255-k % 256))
+                    check(sender)
+                    rect = (k*7 % (width-width//4), k*3 % (height-height//4),
+                            width//4, height//4)
+                    source.fill((255, k % 256, session*64), rect)
+                    check(sender, [rect])
+                check(sender, [])
+            finally:
+                sender.close()
+        assert server.late == 0, "{} tiles dropped as late".format(server.late)
+        assert server.lost == 0, "{} frames lost".format(server.lost)
+        assert server.restarts == 1, "the new sender was not noticed"
+        return server.throughput()
+    finally:
+        server.stop()
+
+
+def main():
+    """
+    Runs the murapix as a remote display only:
+        python3 frame_server.py config.ini [--demo=3] [--listen=udp:5555]
+    or checks the frame ingest on loopback:
+        python3 frame_server.py --loopback
+    """
+    import sys
+    if '--loopback' in sys.argv:
+        for protocol in ('udp', 'tcp'):
+            print(protocol, loopback_test(protocol))
+        return
+    from murapix import Murapix
+    argv = list(sys.argv)
+    if not any(arg.startswith('--listen=') for arg in argv):
+        argv.append('--listen={}'.format(DEFAULT_PORT))
+    Murapix(argv).run()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,157 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Frame timing statistics of murapix.
+
+FrameStats keeps, for each phase of a frame (logic, graphics, remap, ...),
+the durations of the last frames in a fixed size ring buffer. Recording a
+duration is a single store, percentiles are only computed when asked for,
+so it can be left on in production.
+"""
+from array import array
+import json
+import os
+import time
+
+
+class _Ring:
+    """
+    Fixed size ring buffer of floats
+    """
+    def __init__(self, size):
+        self.values = array('d', bytes(8*size))
+        self.size = size
+        self.pos = 0
+        self.count = 0
+
+    def append(self, value):
+        self.values[self.pos] = value
+        self.pos = (self.pos+1) % self.size
+        if self.count < self.size:
+            self.count += 1
+
+    def sorted(self):
+        return sorted(self.values[:self.count])
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.
+    k = min(len(sorted_values)-1, int(round(q/100*(len(sorted_values)-1))))
+    return sorted_values[k]
+
+
+class FrameStats:
+    """
+    window: number of frames the percentiles are computed on
+
+    FrameStats has the following properties:
+        self.frames: the number of frames since the start
+        self.missed: the number of frames whose work took longer than the
+            frame budget, i.e. 1/fps
+        self.journal: None by default. If set to a list, the (phase,
+            seconds) recorded are also appended to it, e.g. to pass them on
+            to another process
+    """
+    PERCENTILES = (50, 95, 99)
+
+    def __init__(self, window=600):
+        self.window = window
+        self.phases = {}
+        self.frames = 0
+        self.missed = 0
+        self.budget = 0.
+        self.journal = None
+        self._periods = _Ring(window)
+        self._last_frame = None
+
+    def record(self, phase, seconds):
+        """
+        Records the duration in seconds of a phase of the current frame
+        """
+        ring = self.phases.get(phase)
+        if ring is None:
+            ring = self.phases[phase] = _Ring(self.window)
+        ring.append(seconds)
+        if self.journal is not None:
+            self.journal.append((phase, seconds))
+
+    def end_frame(self, busy, fps):
+        """
+        busy: time in seconds spent working on the frame, i.e. excluding the
+        time waiting for the next frame
+        fps: the targeted frames per second
+        """
+        now = time.perf_counter()
+        if self._last_frame is not None:
+            self._periods.append(now-self._last_frame)
+        self._last_frame = now
+        self.record('frame', busy)
+        self.frames += 1
+        if fps:
+            self.budget = 1/fps
+            if busy > self.budget:
+                self.missed += 1
+
+    def percentiles(self, phase):
+        """
+        Returns a dict of the percentiles (p50, p95, p99) and mean of the
+        durations of phase, in milliseconds
+        """
+        ring = self.phases.get(phase)
+        values = ring.sorted() if ring is not None else []
+        result = {'p{}'.format(q): 1000*_percentile(values, q)
+                  for q in self.PERCENTILES}
+        result['mean'] = 1000*sum(values)/len(values) if values else 0.
+        return result
+
+    def fps(self):
+        """
+        Returns the measured frames per second over the window
+        """
+        periods = self._periods
+        if not periods.count:
+            return 0.
+        total = sum(periods.values[:periods.count])
+        return periods.count/total if total else 0.
+
+    def summary(self):
+        return {'time': time.time(),
+                'fps': self.fps(),
+                'frames': self.frames,
+                'missed': self.missed,
+                'budget_ms': 1000*self.budget,
+                'phases': {phase: self.percentiles(phase)
+                           for phase in self.phases}}
+
+    def dump(self, path):
+        """
+        Dumps the summary to path. If path ends with .csv, a row per phase
+        is appended to it, else the file is overwritten with a JSON summary.
+        """
+        summary = self.summary()
+        if not path.endswith('.csv'):
+            with open(path, 'w') as f:
+                json.dump(summary, f, indent=2)
+            return
+        columns = ['mean']+['p{}'.format(q) for q in self.PERCENTILES]
+        new_file = not os.path.isfile(path)
+        with open(path, 'a') as f:
+            if new_file:
+                f.write(','.join(['time', 'fps', 'frames', 'missed', 'phase']
+                                 +[c+'_ms' for c in columns])+'\n')
+            for phase, values in summary['phases'].items():
+                row = [summary['time'], summary['fps'], summary['frames'],
+                       summary['missed'], phase]
+                row += [values[c] for c in columns]
+                f.write(','.join(str(v) for v in row)+'\n')
+
+    def overlay_text(self):
+        """
+        Short text line to display the stats on the wall
+        """
+        frame = self.percentiles('frame')
+        return '{:.0f}fps {:.1f}/{:.1f}ms miss {}'.format(self.fps(),
+                                                         frame['p50'],
+                                                         frame['p99'],
+                                                         self.missed)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Gamepad hotplug management of murapix.
+
+GamepadManager keeps a registry of the connected joysticks, each one being
+given a player slot: the first free slot when it connects, freed when it
+disconnects. A controller reconnecting thus usually gets its slot back.
+
+A background thread watches /dev/input with inotify (or, where inotify is
+not available, lists it once per second) and only raises a flag when
+devices come and go. The registry is refreshed by update(), called once per
+frame by Murapix, which does nothing but check that flag unless something
+changed. Games can therefore query the registry on the frame path without
+any system call. The pygame JOYDEVICEADDED and JOYDEVICEREMOVED events may
+also be passed to handle_event.
+
+pygame joysticks must be created by the thread running pygame, hence the
+registry is only ever changed by update().
+"""
+import os
+import select
+import struct
+import threading
+import time
+import pygame
+
+
+INPUT_DIR = '/dev/input'
+#inotify masks, see inotify(7)
+IN_ATTRIB = 0x00000004
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+INOTIFY_EVENT = struct.Struct('iIII')
+#pygame 1.9 has no hotplug events
+HOTPLUG_EVENTS = tuple(getattr(pygame, name) for name in ('JOYDEVICEADDED', 'JOYDEVICEREMOVED')
+                       if hasattr(pygame, name))
+
+
+def _inotify(path):
+    """
+    Returns a file descriptor notified of the devices created and deleted
+    in path, or None if inotify is not available
+    """
+    try:
+        import ctypes
+        libc = ctypes.CDLL(None, use_errno=True)
+        fd = libc.inotify_init()
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+    if libc.inotify_add_watch(fd, path.encode(), IN_CREATE | IN_DELETE | IN_ATTRIB) < 0:
+        os.close(fd)
+        return None
+    return fd
+
+
+def _is_joystick(name):
+    return name.startswith('js') or name.startswith('event')
+
+
+def _joystick_id(joystick):
+    #the instance id, unlike the device index, does not change when another
+    #joystick is disconnected
+    if hasattr(joystick, 'get_instance_id'):
+        return joystick.get_instance_id()
+    return joystick.get_id()
+
+
+class GamepadManager:
+    """
+    max_players: maximum number of player slots, None for no limit
+
+    GamepadManager has the following properties:
+        self.count: the number of connected joysticks
+        self.players: list of the joystick of each player slot, None for the
+            free slots
+        self.changes: incremented each time a joystick connects or
+            disconnects, e.g. to redraw a lobby only when needed
+    """
+    def __init__(self, max_players=None):
+        self.max_players = max_players
+        self.count = 0
+        self.players = []
+        self.changes = 0
+        #joystick instance id: player slot
+        self._slots = {}
+        self._changed = True
+        self._stopping = False
+        self._thread = None
+
+    def start(self):
+        """
+        Starts the background watcher. Also used to restart it after a fork.
+        """
+        self._stopping = False
+        self._changed = True
+        self._thread = threading.Thread(target=self._watch,
+                                        name='murapix-gamepads',
+                                        daemon=True)
+        self._thread.start()
+
+    def _watch(self):
+        fd = _inotify(INPUT_DIR) if os.path.isdir(INPUT_DIR) else None
+        if fd is None:
+            self._poll()
+            return
+        try:
+            while not self._stopping:
+                if not select.select([fd], [], [], 0.5)[0]:
+                    continue
+                data = os.read(fd, 4096)
+                offset = 0
+                while offset < len(data):
+                    _, _, _, length = INOTIFY_EVENT.unpack_from(data, offset)
+                    start = offset+INOTIFY_EVENT.size
+                    name = data[start:start+length].rstrip(b'\0').decode(errors='replace')
+                    offset = start+length
+                    if _is_joystick(name):
+                        self._changed = True
+        finally:
+            os.close(fd)
+
+    def _poll(self):
+        devices = None
+        while not self._stopping:
+            try:
+                current = sorted(x for x in os.listdir(INPUT_DIR) if _is_joystick(x))
+            except OSError:
+                current = []
+            if current != devices:
+                devices = current
+                self._changed = True
+            time.sleep(1)
+
+    def handle_event(self, event):
+        """
+        Reports a pygame event, so that hotplug events refresh the registry
+        at the next update
+        """
+        if event.type in HOTPLUG_EVENTS:
+            self._changed = True
+
+    def update(self):
+        """
+        Refreshes the registry if joysticks came or went. Must be called
+        from the thread running pygame. Returns True if it changed.
+        """
+        if not self._changed:
+            return False
+        self._changed = False
+        if not HOTPLUG_EVENTS:
+            #SDL 1.2 only counts the joysticks when the subsystem starts, the
+            #joysticks of the registry are replaced by the new ones below
+            pygame.joystick.quit()
+            pygame.joystick.init()
+        elif not pygame.joystick.get_init():
+            pygame.joystick.init()
+        #let SDL notice the new devices
+        pygame.event.pump()
+        connected = {}
+        for index in range(pygame.joystick.get_count()):
+            joystick = pygame.joystick.Joystick(index)
+            if not joystick.get_init():
+                joystick.init()
+            connected[_joystick_id(joystick)] = joystick
+        changed = False
+        for instance_id in [k for k in self._slots if k not in connected]:
+            self.players[self._slots.pop(instance_id)] = None
+            changed = True
+        for instance_id, joystick in connected.items():
+            slot = self._slots.get(instance_id)
+            if slot is not None:
+                self.players[slot] = joystick
+                continue
+            try:
+                slot = self.players.index(None)
+            except ValueError:
+                if self.max_players is not None and len(self.players) >= self.max_players:
+                    continue
+                slot = len(self.players)
+                self.players.append(None)
+            self.players[slot] = joystick
+            self._slots[instance_id] = slot
+            changed = True
+        self.count = len(self._slots)
+        if changed:
+            self.changes += 1
+        return changed
+
+    def player(self, slot):
+        """
+        Returns the joystick of the player slot, or None
+        """
+        if 0 <= slot < len(self.players):
+            return self.players[slot]
+        return None
+
+    def slot(self, event):
+        """
+        Returns the player slot of the joystick which sent the pygame event,
+        or None
+        """
+        instance_id = getattr(event, 'instance_id', getattr(event, 'joy', None))
+        return self._slots.get(instance_id)
+
+    def stop(self, timeout=1.0):
+        self._stopping = True
+        if self._thread is not None and self._thread.is_alive():
+            self._thread.join(timeout)
+        self._thread = None
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+LED simulation for the demo mode.
+
+Rather than scaling the scratch surface up, each led is drawn as a dot
+separated from its neighbours by a black gap, and the dead zones of the
+mapping are black, so the demo window looks like the real murapix.
+
+The dot pattern and the dead zones are precomputed once as a mask. Each
+frame, the pixels of the panels which changed are repeated demo*demo times
+and multiplied by the mask in a single vectorized operation per panel,
+directly into the display surface, and only those areas of the display are
+updated.
+"""
+import pygame
+try:
+    from .remap import DirtyPanels
+except (ImportError, SystemError) as e:#if doing screen test
+    from remap import DirtyPanels
+
+
+def led_dot(demo):
+    """
+    Returns the (demo, demo) pattern of a led as a list of lists of 0 and 1.
+    There is no room for a gap when demo is 1.
+    """
+    if demo < 2:
+        return [[1]]
+    gap = max(1, demo//4)
+    size = demo-gap
+    center = (size-1)/2
+    radius = size/2
+    dot = [[0]*demo for _ in range(demo)]
+    for u in range(size):
+        for v in range(size):
+            #round the corners of the larger dots
+            if size < 4 or (u-center)**2+(v-center)**2 <= radius**2:
+                dot[u][v] = 1
+    return dot
+
+
+class LedSimulator:
+    """
+    remap: the PanelRemap of the murapix, giving the areas of the panels
+    demo: number of pixels per simulated led edge
+    deadzones: the ((left, top), (width, height)) of the dead zones, see
+        get_deadzone_addresses
+    """
+    def __init__(self, remap, demo, deadzones):
+        import numpy as np
+        self.remap = remap
+        self.demo = demo
+        width, height = remap.scratch_size
+        self.size = (width*demo, height*demo)
+        dot = np.array(led_dot(demo), dtype=np.uint8)
+        #(x, u, y, v, channel): led (x, y), pixel (u, v) of the led
+        mask = np.empty((width, demo, height, demo, 1), dtype=np.uint8)
+        mask[...] = dot[None, :, None, :, None]
+        for (left, top), (w, h) in deadzones:
+            mask[left:left+w, :, top:top+h] = 0
+        self.mask = mask
+        self.dirty = DirtyPanels(remap, 'auto')
+        self._full = True
+
+    def render(self, scratch, screen, changed=None):
+        """
+        Draws the leds of scratch on screen.
+
+        changed: list of indices in remap.panels of the panels to draw. By
+        default they are detected by comparing scratch to the previous frame.
+        Everything is drawn on the first call.
+
+        returns the list of pygame.Rect of screen which were drawn
+        """
+        import numpy as np
+        demo = self.demo
+        if changed is None:
+            changed = self.dirty.update(scratch)
+        source = pygame.surfarray.pixels3d(scratch)
+        target = pygame.surfarray.pixels3d(screen)
+        width, height = self.remap.scratch_size
+        #view with the same axes as the mask, raises if it cannot be a view
+        target.shape = (width, demo, height, demo, 3)
+        mask = self.mask
+        if self._full:
+            self._full = False
+            np.multiply(source[:, None, :, None, :], mask, out=target)
+            rects = [pygame.Rect((0, 0), self.size)]
+        else:
+            rects = []
+            panels = self.remap.panels
+            for k in changed:
+                area = panels[k][2]
+                x = slice(area.left, area.right)
+                y = slice(area.top, area.bottom)
+                np.multiply(source[x, None, y, None, :], mask[x, :, y],
+                            out=target[x, :, y])
+                rects.append(pygame.Rect(area.left*demo, area.top*demo,
+                                         area.width*demo, area.height*demo))
+        del source, target
+        return rects
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Scrolling text along the panels of a murapix.
+
+A ticker scrolls its messages from right to left along a path, i.e. a list
+of areas of the scratch surface, one panel high, as returned by
+murapix.get_marquee_path: the panels of a row, skipping its dead zones so
+that no text is lost behind them, and possibly several rows, the text
+leaving a row on the left to go on on the right of the previous one.
+
+Each message is rendered once, through the TextCache, when it enters the
+path. Each frame, the band of the ticker is cleared and the visible parts of
+the messages are blitted from their rendered strip at their offset in each
+area of the path, in a single blits call: nothing is rendered nor allocated
+but the list of blits. The speed is in pixels per frame and may be a
+fraction, the offset being kept as a float.
+
+Messages are queued with push, e.g. by a task reading a live feed, and
+follow each other gap pixels apart. Several tickers may run at once, e.g.
+on different rows, in a Marquee.
+"""
+from collections import deque
+from math import floor
+import pygame
+try:
+    from .text_cache import TextCache
+except (ImportError, SystemError) as e:#if doing screen test
+    from text_cache import TextCache
+
+
+class Ticker:
+    """
+    path: list of ((left, top), (width, height)) areas the text goes
+        through, see murapix.get_marquee_path. The text enters at the end of
+        the path and leaves at its start.
+    size: size of the font
+    speed: pixels per frame, may be a fraction
+    color: color of the text
+    background: color the band of the ticker is cleared with, e.g.
+        (0, 0, 0, 0) when drawing on a transparent layer
+    gap: pixels between two messages
+    loop: True to queue each message again once it left the path, so the
+        messages go round until others are pushed
+    top: position of the text in the areas, centered by default
+    text: the TextCache to render the messages with, e.g. Murapix.text
+    name: path to the font file, None for the default font
+
+    Ticker has the following properties:
+        self.queue: the messages waiting to enter the path
+        self.length: the length of the path in pixels
+        self.shown: the number of messages which went through the path
+        self.bands: the pygame.Rect cleared and drawn in each area
+    """
+    def __init__(self, path, size, speed=1., color=(255, 255, 255),
+                 background=(0, 0, 0), gap=16, loop=False, top=None,
+                 text=None, name=None):
+        assert path, "the path of a ticker needs at least one area"
+        assert speed > 0, "speed must be positive"
+        self.size = size
+        self.speed = speed
+        self.color = color
+        self.background = background
+        self.gap = gap
+        self.loop = loop
+        self.name = name
+        self.text = text if text is not None else TextCache()
+        self.queue = deque()
+        self.shown = 0
+        height = min(h for _, (_, h) in path)
+        strip_height = min(height, self.text.font(size, name).get_height())
+        if top is None:
+            top = (height-strip_height)//2
+        #(start in the path, left, top, width) of each area, and its band
+        self._areas = []
+        self.bands = []
+        start = 0
+        for (left, area_top), (width, _) in path:
+            self._areas.append((start, left, area_top+top, width))
+            self.bands.append(pygame.Rect(left, area_top+top, width, strip_height))
+            start += width
+        self.length = start
+        self._strip_height = strip_height
+        #[rendered message, message, position of its left in the path]
+        self._running = deque()
+        self._blits = []
+
+    def push(self, message):
+        """
+        Queues message, shown once the previous ones made room for it
+        """
+        self.queue.append(message)
+
+    def clear(self):
+        """
+        Removes all the messages, shown or queued
+        """
+        self.queue.clear()
+        self._running.clear()
+
+    def step(self):
+        """
+        Moves the messages by self.speed pixels, makes the next message of
+        the queue enter the path when there is room for it
+        """
+        running = self._running
+        for item in running:
+            item[2] -= self.speed
+        while running and running[0][2]+running[0][0].get_width() <= 0:
+            _, message, _ = running.popleft()
+            self.shown += 1
+            if self.loop:
+                self.queue.append(message)
+        if self.queue:
+            if not running:
+                position = float(self.length)
+            else:
+                last = running[-1]
+                position = last[2]+last[0].get_width()+self.gap
+            if position <= self.length:
+                message = self.queue.popleft()
+                rendered = self.text.render(message, self.size, self.color,
+                                            None, False, self.name)
+                running.append([rendered, message, position])
+
+    def draw(self, surface):
+        """
+        Clears the band of the ticker on surface and draws the messages on
+        it. Returns the list of pygame.Rect drawn.
+        """
+        for band in self.bands:
+            surface.fill(self.background, band)
+        blits = self._blits
+        blits.clear()
+        height = self._strip_height
+        for rendered, _, position in self._running:
+            left = floor(position)
+            right = left+rendered.get_width()
+            for start, x, y, width in self._areas:
+                if right <= start or left >= start+width:
+                    continue
+                clip = max(left, start)
+                blits.append((rendered, (x+clip-start, y),
+                              (clip-left, 0, min(right, start+width)-clip, height)))
+        if blits:
+            surface.blits(blits, False)
+        return self.bands
+
+
+class Marquee:
+    """
+    Runs several tickers at once, each one drawn either on the surface given
+    to draw, or on a layer of the compositor, see compositor.py.
+
+    Marquee has the following properties:
+        self.tickers: the list of the tickers
+    """
+    def __init__(self):
+        self.tickers = []
+        self._layers = {}
+
+    def add(self, ticker, layer=None):
+        """
+        Adds ticker, drawn on layer if given. Returns ticker.
+        """
+        self.tickers.append(ticker)
+        if layer is not None:
+            self._layers[ticker] = layer
+        return ticker
+
+    def remove(self, ticker):
+        self.tickers.remove(ticker)
+        self._layers.pop(ticker, None)
+
+    def step(self):
+        for ticker in self.tickers:
+            ticker.step()
+
+    def draw(self, surface):
+        """
+        Draws the tickers, marking the layers drawn on as dirty. Returns the
+        list of pygame.Rect drawn on surface.
+        """
+        rects = []
+        for ticker in self.tickers:
+            layer = self._layers.get(ticker)
+            if layer is None:
+                rects.extend(ticker.draw(surface))
+            else:
+                for rect in ticker.draw(layer.surface):
+                    layer.mark_dirty(rect)
+        return rects
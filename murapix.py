@@ -29,18 +29,21 @@ How to use:
     python main.py config.ini
     python main.py config.ini [--demo]
     python main.py config.ini [--demo=3]
+    python main.py config.ini [--backend=null]
+    python main.py config.ini [--listen=udp:5555]
     
 The config file is meant to describe your murapix hardware, i.e. how your 
 panels are laid out and how many leds they have. IMPORTANT: all panel must
-be the same!
+be the same size, as hzeller library drives all of them with the same
+geometry! They may be rectangular and mounted rotated or mirrored.
  
 the config file must always contain a 'matrix' section with the following
  variables:
     mapping: several lines of coma separated values. A value must be a '.', 
     indicating an empty place, or an integer. The integers must form a sequence
     from 1 to the total number of panels.
-    led-rows: the number of leds per row for each panel
-    led-cols: the number of leds per column for each panel
+    led-rows: the number of rows of leds of each panel, i.e. its height
+    led-cols: the number of columns of leds of each panel, i.e. its width
     example:
         [matrix]
         mapping = ., ., 1, .
@@ -48,34 +51,109 @@ the config file must always contain a 'matrix' section with the following
                   5, 6, 7, 8
         led-rows = 64
         led-cols = 64
+    
+    optionally, orientation gives how some panels are mounted, as coma
+    separated panel:orientation values. An orientation is one of rot0, rot90,
+    rot180, rot270 (clockwise), flip-x, flip-y, or several of them joined by
+    "+". rot90 and rot270 need square panels. example:
+        orientation = 2: rot180, 5: flip-x
+    
+    optionally, the colors sent to the LED panels are corrected with gamma
+    (e.g. 2.2), white-balance (the red, green, blue values shown for white),
+    brightness (in percent) and dithering (yes to dither the dark shades
+    over several frames). example:
+        gamma = 2.2
+        white-balance = 255, 220, 200
+        brightness = 80
+        dithering = yes
 
 @author: hyamanieu
 """
 from configparser import ConfigParser
+from functools import lru_cache
 import os
 import sys
 import pygame
 import pygame.locals as pgl
-from PIL import Image
 try:
     from .custom_virtual_gamepads import set_up_gamepad
 except (ImportError, SystemError) as e:#if doing screen test
     from custom_virtual_gamepads import set_up_gamepad
+try:
+    from .gamepads import GamepadManager
+except (ImportError, SystemError) as e:#if doing screen test
+    from gamepads import GamepadManager
+try:
+    from .remap import PanelRemap, ChainFrame, PaletteFrame, DirtyPanels
+except (ImportError, SystemError) as e:#if doing screen test
+    from remap import PanelRemap, ChainFrame, PaletteFrame, DirtyPanels
+try:
+    from .pipeline import OutputPipeline
+except (ImportError, SystemError) as e:#if doing screen test
+    from pipeline import OutputPipeline
+try:
+    from .frame_stats import FrameStats
+except (ImportError, SystemError) as e:#if doing screen test
+    from frame_stats import FrameStats
+try:
+    from .scheduler import FixedStepScheduler
+except (ImportError, SystemError) as e:#if doing screen test
+    from scheduler import FixedStepScheduler
+try:
+    from .backends import get_backend, init_pygame_display
+except (ImportError, SystemError) as e:#if doing screen test
+    from backends import get_backend, init_pygame_display
+try:
+    from .led_simulation import LedSimulator
+except (ImportError, SystemError) as e:#if doing screen test
+    from led_simulation import LedSimulator
+try:
+    from .recording import FrameRecorder
+except (ImportError, SystemError) as e:#if doing screen test
+    from recording import FrameRecorder
+try:
+    from .color_correction import ColorCorrection
+except (ImportError, SystemError) as e:#if doing screen test
+    from color_correction import ColorCorrection
+try:
+    from .text_cache import TextCache
+except (ImportError, SystemError) as e:#if doing screen test
+    from text_cache import TextCache
+try:
+    from .frame_server import FrameServer
+except (ImportError, SystemError) as e:#if doing screen test
+    from frame_server import FrameServer
+try:
+    from .render_process import RenderProcess
+except (ImportError, SystemError) as e:#if doing screen test
+    from render_process import RenderProcess
+try:
+    from .compositor import Compositor
+except (ImportError, SystemError) as e:#if doing screen test
+    from compositor import Compositor
+try:
+    from .marquee import Marquee, Ticker
+except (ImportError, SystemError) as e:#if doing screen test
+    from marquee import Marquee, Ticker
+try:
+    from .resolution import ResolutionScaler, scaled_size
+except (ImportError, SystemError) as e:#if doing screen test
+    from resolution import ResolutionScaler, scaled_size
 import signal
+import inspect
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter
 
 
 CURRDIR = os.path.abspath(os.path.dirname(__file__))
-sys.path.append(os.path.join(CURRDIR, 'matrix','bindings','python'))
-from rgbmatrix import RGBMatrix, RGBMatrixOptions
 
 
-def init_pygame_display(width, height):
-  os.putenv('SDL_VIDEODRIVER', 'fbcon')
-  os.environ["SDL_VIDEODRIVER"] = "dummy"
-  pygame.init()
-  #pygame.display.set_mode((width, height), 0, 24)
-  #return pygame.display.get_surface()
-  return pygame.Surface((width, height))
+async def _maybe_await(result):
+    #the game hooks may be coroutine functions or plain functions
+    if inspect.isawaitable(result):
+        return await result
+    return result
 
 
 def process_input_arg(argv):
@@ -85,14 +163,18 @@ def process_input_arg(argv):
     The second argument is an integer for the demo. If set to 0, then the 
     pygame surface will be sent to the matrix leds. Else, it will be outputed
     on the normal screen with a scaling factor.
+    The --backend and --listen arguments are read by process_backend_arg
+    and process_listen_arg.
     """
-    assert (len(argv)<4),"maximum 2 arguments"
+    assert (len(argv)<6),"maximum 4 arguments"
     assert (len(argv)>1),"needs at least one argument to the config file"
     
     demo = 0
     configfile = ''
     for arg in argv:
-        if "--demo" in arg:
+        if arg.startswith("--backend") or arg.startswith("--listen"):
+            continue
+        elif "--demo" in arg:
             demo = arg.split('=')
             if len(demo) == 1:
                 demo = 1
@@ -102,6 +184,25 @@ def process_input_arg(argv):
             configfile = arg
     assert (os.path.isfile(configfile)), configfile+" should be a path to the config file"
     return configfile, demo
+
+
+def process_backend_arg(argv):
+    """
+    Returns the output backend name given as --backend=NAME, or None.
+    """
+    for arg in argv:
+        if arg.startswith("--backend="):
+            return arg.split('=', 1)[1]
+
+
+def process_listen_arg(argv):
+    """
+    Returns the address given as --listen=ADDRESS to receive the frames
+    from the network, or None. See frame_server.parse_address.
+    """
+    for arg in argv:
+        if arg.startswith("--listen="):
+            return arg.split('=', 1)[1]
             
 
 
@@ -146,8 +247,6 @@ def get_config(configfile):
     
     led_rows = config.getint('matrix','led-rows')
     led_cols = config.getint('matrix','led-cols')
-    assert (led_rows==led_cols), "For now, murapix can only control square led panels"
-    #TODO: check if non-square pannels work
     width = number_of_cols * led_cols
     height = number_of_rows * led_rows
     
@@ -163,6 +262,66 @@ def get_config(configfile):
     return mapping, width, height, max_number_of_panels, led_rows, led_cols, parallel
     
     
+_RECT_SCORES = {'surface': lambda rows, cols: rows*cols,
+                'diag': lambda rows, cols: rows**2+cols**2}
+
+
+def _maximal_rects(mapping):
+    """
+    Yields (top, left, rows, cols) for the maximal rectangles of panels in the
+    mapping, and some smaller ones.
+    
+    For each row of the mapping, the number of panels stacked above each 
+    place forms a histogram whose largest rectangles are found with a stack,
+    in linear time.
+    """
+    heights = [0]*len(mapping[0])
+    for i, n in enumerate(mapping):#x, rows
+        for j, m in enumerate(n):#y, panel number
+            heights[j] = heights[j]+1 if m else 0
+        stack = []#(first column, height)
+        for j, h in enumerate(heights+[0]):
+            start = j
+            while stack and stack[-1][1] >= h:
+                start, stacked = stack.pop()
+                if stacked:
+                    yield (i-stacked+1, start, stacked, j-start)
+            stack.append((start, h))
+
+
+@lru_cache(maxsize=64)
+def _largest_rects(mapping, key, k):
+    """
+    mapping: tuple of tuples, as the cache needs hashable arguments
+    
+    Returns a tuple of at most k (top, left, rows, cols) of non overlapping
+    rectangles, each one being the largest of what is left by the previous
+    ones.
+    """
+    if key not in _RECT_SCORES:
+        raise ValueError('Key must be "surface" or "diag". {} was entered'.format(key))
+    score = _RECT_SCORES[key]
+    #same order as the sub shapes were tried: largest first, then the
+    #highest, then the first from the top left
+    order = lambda r: (-score(r[2], r[3]), -r[2], r[0], r[1])
+    mapping = [list(n) for n in mapping]
+    rects = []
+    for _ in range(k):
+        best = min(_maximal_rects(mapping), key=order, default=None)
+        if best is None:
+            break
+        rects.append(best)
+        top, left, rows, cols = best
+        for i in range(top, top+rows):
+            mapping[i][left:left+cols] = [None]*cols
+    return tuple(rects)
+
+
+def _sub_mapping(mapping, rect):
+    top, left, rows, cols = rect
+    return [list(n[left:left+cols]) for n in mapping[top:top+rows]]
+
+
 def get_largest_rect(mapping, key='surface'):
     """
     get the largest rectangle from the mapping of LED matrices.
@@ -170,34 +329,112 @@ def get_largest_rect(mapping, key='surface'):
     "Largest" maybe calculated by two methods:
         "surface": the rectangle with the largest surface
         "diag": the rectangle with the largest diagonal
+    
+    Returns the part of the mapping inside the rectangle, as a list of lists,
+    or None if there is no panel. Results are cached per mapping.
+    """
+    rects = _largest_rects(tuple(map(tuple, mapping)), key, 1)
+    if rects:
+        return _sub_mapping(mapping, rects[0])
+
+
+def get_largest_rects(mapping, k, key='surface'):
     """
+    get up to k non overlapping rectangles from the mapping of LED matrices,
+    e.g. to lay out several UI regions. The first one is the largest 
+    rectangle, the second one the largest rectangle among the panels left,
+    and so on. See get_largest_rect for key.
     
-    #https://stackoverflow.com/questions/19414673/in-numpy-how-to-efficiently-list-all-fixed-size-submatrices    
-    from numpy.lib.stride_tricks import as_strided
-    from itertools import product    
-    import numpy as np
-    m = np.array(mapping)
-    l = product(range(m.shape[0],0,-1),range(m.shape[1],0,-1))
-    if key=='surface':
-        all_shapes = sorted(l, key=lambda row: row[0]*row[1],reverse=True)
-    elif key=='diag':
-        all_shapes = sorted(l, key=lambda row: row[0]**2+row[1]**2,reverse=True)
-    else:
-        raise ValueError('Key must be "surface" or "diag". {} was entered'.format(key))
-        
-    for sub_shape in all_shapes:
-        view_shape = tuple(np.subtract(m.shape, sub_shape) + 1) + sub_shape
-        arr_view = as_strided(m, view_shape, m.strides * 2)
-        arr_view = arr_view.reshape((-1,) + sub_shape)
-        for i in arr_view:
-            if i.all():
-                return i
+    Returns a list of parts of the mapping inside the rectangles.
+    """
+    rects = _largest_rects(tuple(map(tuple, mapping)), key, k)
+    return [_sub_mapping(mapping, rect) for rect in rects]
+
+
+def _find_panel(mapping, panel):
+    for i, n in enumerate(mapping):#x, rows
+        for j, m in enumerate(n):#y, panel number
+            if m == panel:
+                return i, j
+
+
+def get_orientation(configfile):
+    """
+    configfile: path to a .ini file with the murapix configuration
     
-def get_largest_rect_add(led_rows, m,n=None,key='surface'):
+    returns the optional orientation of the 'matrix' section as a dict of
+    panel number: orientation, see remap.parse_orientation
+    """
+    config = ConfigParser()
+    config.read(configfile)
+    if not config.has_option('matrix','orientation'):
+        return {}
+    orientation = {}
+    for value in config.get('matrix','orientation').replace('\n', ',').split(','):
+        if not value.strip():
+            continue
+        try:
+            panel, name = value.split(':')
+            panel = int(panel)
+        except ValueError:
+            err_mess = 'orientation must contain coma separated panel:orientation values'
+            raise ValueError(err_mess)
+        orientation[panel] = name.strip()
+    return orientation
+
+
+def get_color_config(configfile):
+    """
+    configfile: path to a .ini file with the murapix configuration
+    
+    returns the optional gamma, white-balance, brightness and dithering of
+    the 'matrix' section as a dict of ColorCorrection arguments, empty if
+    none is set
+    """
+    config = ConfigParser()
+    config.read(configfile)
+    color = {}
+    if config.has_option('matrix','gamma'):
+        color['gamma'] = config.getfloat('matrix','gamma')
+    if config.has_option('matrix','white-balance'):
+        try:
+            white_balance = tuple(int(c) for c in config.get('matrix','white-balance').split(','))
+        except ValueError:
+            white_balance = ()
+        if len(white_balance) != 3:
+            err_mess = 'white-balance must be 3 coma separated integers: red, green, blue'
+            raise ValueError(err_mess)
+        color['white_balance'] = white_balance
+    if config.has_option('matrix','brightness'):
+        color['brightness'] = config.getint('matrix','brightness')
+    if config.has_option('matrix','dithering'):
+        color['dithering'] = config.getboolean('matrix','dithering')
+    return color
+
+
+def get_output_config(configfile):
+    """
+    configfile: path to a .ini file with the murapix configuration
+    
+    returns the options of the optional 'output' section as a dict, e.g.:
+        [output]
+        backend = record
+        record-path = frames.raw
+    """
+    config = ConfigParser()
+    config.read(configfile)
+    if not config.has_section('output'):
+        return {}
+    return dict(config.items('output'))
+
+
+def get_largest_rect_add(led_rows, m,n=None,key='surface',led_cols=None):
     """
     Returns the pixel/led address of the largest rectangle using pygame standard:
         ((left, top), (width, height))
     
+    led_cols is needed for non square panels, it is led_rows by default.
+    
     
     ____
     usage
@@ -211,44 +448,97 @@ def get_largest_rect_add(led_rows, m,n=None,key='surface'):
     >>> (left, top), (width, height) = get_largest_rect_add(led_rows,mapping,rec)
     
     """
-    import numpy as np
     if n is None:
-        n = get_largest_rect(m,key=key)
-    if type(m) is not np.ndarray:
-        m = np.array(m)
-    
-    top, left = (np.argwhere(m==n[0][0])*led_rows).flatten().tolist()
-    _t, _l = ((1+np.argwhere(m==n[-1][-1]))*led_rows).flatten().tolist()
-    width, height = _l-left, _t-top
-    
+        top, left, rows, cols = _largest_rects(tuple(map(tuple, m)), key, 1)[0]
+    else:
+        top, left = _find_panel(m, n[0][0])
+        bottom, right = _find_panel(m, n[-1][-1])
+        rows, cols = bottom-top+1, right-left+1
+    if led_cols is None:
+        led_cols = led_rows
     
-    return ((left, top),(width, height))
+    return ((left*led_cols, top*led_rows),(cols*led_cols, rows*led_rows))
+
+
+def get_largest_rects_add(led_rows, mapping, k, key='surface', led_cols=None):
+    """
+    Returns the pixel/led addresses of up to k non overlapping rectangles,
+    see get_largest_rects, as a list of ((left, top), (width, height))
+    """
+    if led_cols is None:
+        led_cols = led_rows
+    return [((left*led_cols, top*led_rows),(cols*led_cols, rows*led_rows))
+            for top, left, rows, cols in _largest_rects(tuple(map(tuple, mapping)),
+                                                        key, k)]
+
     
-def get_deadzone_addresses(mapping, led_rows):
+def get_deadzone_addresses(mapping, led_rows, led_cols=None):
     """
     Yields a list of ((left, top), (width, height)) for each square where
     there is a dead zone in the mapping, i.e. no LED in the matrix.
+    led_cols is needed for non square panels, it is led_rows by default.
     """
+    if led_cols is None:
+        led_cols = led_rows
     for i, n in enumerate(mapping):#x, rows
             for j, m in enumerate(n):#y, panel number
                 if m is not None:
                     continue
                 #rectangle to extract from the width*height scratch surface
-                yield ((led_rows*j,led_rows*i),(led_rows,led_rows))
+                yield ((led_cols*j,led_rows*i),(led_cols,led_rows))
 
 
-def get_panel_adresses(mapping, led_rows):
+def get_panel_adresses(mapping, led_rows, led_cols=None):
     """
     Yields a list of ((left, top), (width, height)) for each square where
     there is a panel in the mapping.
+    led_cols is needed for non square panels, it is led_rows by default.
     """
+    if led_cols is None:
+        led_cols = led_rows
     for i, n in enumerate(mapping):#x, rows
             for j, m in enumerate(n):#y, panel number
                 if m is None:
                     continue
                 #rectangle to extract from the width*height scratch surface
-                yield ((led_rows*j,led_rows*i),(led_rows,led_rows))
+                yield ((led_cols*j,led_rows*i),(led_cols,led_rows))
 
+def get_marquee_path(mapping, led_rows, led_cols=None, rows=None,
+                     skip_deadzones=True):
+    """
+    Returns the path of a scrolling text, see marquee.py, as a list of
+    ((left, top), (width, height)) areas, from the left to the right of each
+    row of panels of the mapping, row after row.
+    
+    rows: indices of the rows of the mapping the text goes through, in
+        order, by default all rows from top to bottom
+    skip_deadzones: if True, the path jumps over the dead zones between the
+        panels of a row, else the text goes on behind them
+    led_cols is needed for non square panels, it is led_rows by default.
+    """
+    if led_cols is None:
+        led_cols = led_rows
+    if rows is None:
+        rows = range(len(mapping))
+    panels = list(get_panel_adresses(mapping, led_rows, led_cols))
+    path = []
+    for i in rows:
+        lefts = sorted(left for (left, top), _ in panels if top == led_rows*i)
+        if not lefts:
+            continue
+        if not skip_deadzones:
+            path.append(((lefts[0], led_rows*i),
+                         (lefts[-1]+led_cols-lefts[0], led_rows)))
+            continue
+        #adjacent panels make a single area
+        start = previous = lefts[0]
+        for left in lefts[1:]+[None]:
+            if left != previous+led_cols:
+                path.append(((start, led_rows*i),
+                             (previous+led_cols-start, led_rows)))
+                start = left
+            previous = left
+    return path
 
 
 class Murapix:
@@ -258,20 +548,63 @@ class Murapix:
     The screen surface on which you need to blit the sprites is self.scratch.
     
     Murapix has the following properties:
+        self.configfile: the path to the config file
         self.mapping: how the different LED panels are put in place
         self.demo: 0 if going to the LED panels, a positive int if it is going to the standart screen
+        self.demo_style: "leds" by default, the demo mode draws each LED as a dot and the dead zones in black, updating only the panels which changed. If set to "scale", self.scratch is just scaled up.
+        self.listen: None by default. If set to an address such as "udp:5555", given with --listen=ADDRESS or the listen option of the [output] section of the config file, the frames sent over the network by a frame_server.FrameSender are blitted on self.scratch after graphics_loop, so the murapix can be the remote display of another machine.
+        self.frame_server: the FrameServer receiving the frames when self.listen is set, see its counters and throughput().
+        self.recorder: None by default. Set by self.start_recording to a FrameRecorder writing each remapped frame to a file, to be played by player.py.
+        self.backend: the output backend the frames are drawn on, see backends.py. Selected with --backend=NAME or in the [output] section of the config file, by default "demo" with --demo, else "hzeller".
         self.width: the total width of the rectangle enclosing all panels in pixel        
         self.height: the total height of the rectangle enclosing all panels in pixel
         self.max_number_of_panels: the number of panels
-        self.led_rows: the number of pixel for both height and width of the panels
+        self.led_rows: the number of pixel for the height of the panels
+        self.led_cols: the number of pixel for the width of the panels
+        self.orientation: dict of panel number: orientation for the panels which are not mounted upright, see get_orientation
+        self.color: None if the config file sets no color correction, else the ColorCorrection applied to the frames sent to the LED panels, see get_color_config and self.set_brightness.
         self.scratch: the total pygame surface which is going to be processed by the murapix draw methods to either go the LED panels or, in demo mode, to the standart screen.
+        self.layers: None by default. The Compositor of the layers added with self.add_layer, composited into self.scratch after graphics_loop, only in the areas which changed. Once layers are used, draw on them rather than on self.scratch, e.g. self.layers["sprites"].
+        self.marquee: None by default. The Marquee of the scrolling texts added with self.add_ticker, moved and drawn after graphics_loop.
+        self.text: the TextCache to render text with, caching the fonts and the rendered surfaces, e.g. self.text.draw(self.scratch, "GAME OVER", (0, 0), 16). self.text.draw_glyphs draws text changing every frame, e.g. scores, from cached digits.
+        self.remap: the PanelRemap precomputed from the mapping, used to put the panels of self.scratch in the order of the LED chains.
         self.gamepad: None by default. If set to a path string pointing to an SVG, will start the virtual gamepad
+        self.hotplug: False by default. If set to True, self.gamepads is started even without virtual gamepad, e.g. for usb or bluetooth controllers.
+        self.gamepads: None by default. The GamepadManager keeping track of the joysticks connecting and disconnecting and of their player slot, started with the virtual gamepad or with self.hotplug. Query it rather than pygame.joystick or /dev/input, e.g. self.gamepads.count or self.gamepads.player(0).
+        self.multiprocess: False by default. If set to True, setup, logic_loop and graphics_loop run in a worker process drawing on its own self.scratch, and the frames are handed over through shared memory to this process, which outputs them, see render_process.py. Linux only.
+        self.render_process: the RenderProcess running the game in multiprocess mode.
+        self.pipelined: False by default. If set to True, the frames are sent to the LED panels by a background thread while the next frame is computed.
+        self.pipeline_depth: number of scratch surfaces used to hand over frames to the background thread in pipelined mode, or to this process in multiprocess mode, 3 by default.
+        self.dirty_detection: None by default, all panels are sent to the LED panels each frame. If set to "auto", only the panels of self.scratch which changed are sent. If set to "manual", only the panels reported with self.mark_dirty are sent.
+        self.dirty: the DirtyPanels tracking changes when self.dirty_detection is set. self.dirty.skipped is the number of panels skipped on the last frame.
+        self.dynamic_resolution: False by default. If set to True, graphics_loop draws at a lower resolution when the frames take too long for self.fps, see resolution.py: self.scratch is then smaller, by self.render_scale, and is upscaled to the size of the murapix, in the remap itself when possible.
+        self.render_scales: the render scales used with self.dynamic_resolution, (1., .75, .5) by default.
+        self.render_scale: the scale self.scratch is drawn at, 1 unless self.dynamic_resolution is set. Draw at self.render_scale times the usual coordinates, e.g. with pygame.transform.scale for sprites.
+        self.render_size: the (width, height) of self.scratch at self.render_scale.
+        self.resolution: the ResolutionScaler choosing self.render_scale when self.dynamic_resolution is set.
+        self.palette: None by default, self.scratch is an RGB surface. Set with self.set_palette to draw on an 8 bit self.scratch, remapped as it is and expanded to RGB with the palette once per frame, at the end. Changing the palette changes the colors of the pixels already drawn, e.g. for color cycling.
+        self.indexed: the PaletteFrame the 8 bit self.scratch is remapped onto when self.palette is set.
+        self.stats: the FrameStats timing each phase of the frames, see self.get_stats
+        self.stats_dump: None by default. If set to a path, self.stats is dumped to it every self.stats_interval seconds, as CSV if the path ends with .csv, else as JSON.
+        self.stats_overlay: False by default. If set to True, the frame timings are shown on the top of the largest rectangle of the murapix.
+        self.logic_fps: None by default, logic_loop and graphics_loop are called once per frame, self.fps times per second. If set to a number, logic_loop is called at this fixed rate whatever the rendering speed, and frames are rendered at most self.fps times per second, see self.scheduler.
+        self.scheduler: the FixedStepScheduler used when self.logic_fps is set. It may also be set directly to tune it.
+        self.alpha: with a scheduler, the fraction of logic step elapsed since the last logic_loop when rendering, also passed to graphics_loop(alpha) if it takes an argument.
     """
-    def __init__(self):
-        configfile, demo = process_input_arg(sys.argv)
+    #nodenames of the raspberry pis configured for murapix
+    murapix_hosts = ("rpi-murapix","raspberrypi")
+    
+    def __init__(self, argv=None):
+        """
+        argv: the command line arguments, sys.argv by default
+        """
+        if argv is None:
+            argv = sys.argv
+        configfile, demo = process_input_arg(argv)
         (mapping, width, height, max_number_of_panels, 
          led_rows, led_cols, parallel) = get_config(configfile)
         self.RUNNING = True
+        self.configfile = configfile
         self.mapping = mapping
         self.demo = demo
         self.width = width
@@ -281,7 +614,47 @@ class Murapix:
         self.led_cols = led_cols
         self.parallel = parallel
         self.scratch = pygame.Surface((width, height))
+        self.orientation = get_orientation(configfile)
+        self.remap = PanelRemap(mapping, led_rows, led_cols, parallel,
+                                self.orientation)
+        color = get_color_config(configfile)
+        self.color = ColorCorrection(self.remap.size, **color) if color else None
         self.gamepad = None
+        self.hotplug = False
+        self.gamepads = None
+        self.pipelined = False
+        self.pipeline_depth = 3
+        self.pipeline = None
+        self.multiprocess = False
+        self.render_process = None
+        self.dirty_detection = None
+        self.dirty = None
+        self.stats = FrameStats()
+        self.stats_dump = None
+        self.stats_interval = 10
+        self._next_dump = None
+        self.stats_overlay = False
+        self._overlay = None
+        self.logic_fps = None
+        self.scheduler = None
+        self.alpha = 0.
+        self.demo_style = 'leds'
+        self.led_simulator = None
+        self.text = TextCache()
+        self.layers = None
+        self.marquee = None
+        self.dynamic_resolution = False
+        self.render_scales = (1., .75, .5)
+        self.render_scale = 1.
+        self.render_size = (width, height)
+        self.resolution = None
+        self._full_scratch = self.scratch
+        self._scaled_scratches = {}
+        self.palette = None
+        self.indexed = None
+        self._demo_rgb = None
+        self.recorder = None
+        self.frame_server = None
         
         
         #signal handlers to quite gracefully
@@ -292,37 +665,13 @@ class Murapix:
     This is free software, and you are welcome to redistribute it
     under certain conditions.""")#LICENSE
         
-        if not demo:
-            #must be a raspberry pi configured for murapix, hence nodename
-            #must be "rpi-murapix"
-            if os.uname().nodename not in ("rpi-murapix","raspberrypi"):
-                raise EnvironmentError("Not a murapix, please select demo mode with --demo=X")
-            
-            print('Going on the Murapix!')
-            print('{0} channel(s) of [{1}*{2}={3} LED] X [{4} LED]'.format(parallel,
-                                                     max_number_of_panels//parallel,
-                                                     led_rows,
-                                                     max_number_of_panels*led_rows//parallel,
-                                                     led_cols))
-            #the screen is just a single line of panels
-            
-            options = RGBMatrixOptions()
-            options.rows = options.cols = led_rows
-            options.parallel = parallel
-            options.chain_length = max_number_of_panels//parallel
-            options.hardware_mapping = 'regular'
-            options.drop_privileges = 0
-            self.matrix = RGBMatrix(options = options)
-            
-            self.double_buffer = self.matrix.CreateFrameCanvas()
-            self._screen = init_pygame_display((max_number_of_panels//parallel)*led_rows, 
-                                              led_cols*parallel)
-        else:      
-            print('Going on the standart screen...')      
-            pygame.init()
-            self._screen = pygame.display.set_mode((width*demo,height*demo),0, 32)
-            
-            
+        output = get_output_config(configfile)
+        backend = (process_backend_arg(argv) or output.get('backend')
+                   or ('demo' if demo else 'hzeller'))
+        self.backend = get_backend(backend)(self, output)
+        self.listen = process_listen_arg(argv) or output.get('listen')
+        self.backend.open()
+        
         self.clock = pygame.time.Clock()
         self.fps = 15  
         
@@ -337,6 +686,26 @@ class Murapix:
         pass
     
     def run(self):
+        self.start_inputs()
+        self.start_dirty_detection()
+        
+        draw = self.backend.draw
+        if self.multiprocess:
+            self.run_multiprocess(draw)
+            self.close()
+            return
+        self.start_frame_server()
+        self.setup()
+        if self.pipelined:
+            draw = self.start_pipeline_draw(draw)
+        self.run_frames(draw)
+        self.close()
+    
+    def start_inputs(self):
+        """
+        Starts the virtual gamepad if self.gamepad is set, else the hotplug
+        of the joysticks if self.hotplug is set
+        """
         if self.gamepad:
             try:
                 self.start_gamepad()
@@ -345,135 +714,704 @@ class Murapix:
                 print(e)         
                 self.close()
                 raise e
-        self.setup()
+        elif self.hotplug:
+            self.start_hotplug()
+    
+    def run_async(self):
+        """
+        Same as run(), the frames being driven by an asyncio event loop, so
+        that the game can await network calls (live feeds, gamepad bridges...)
+        without stalling the frames. setup, logic_loop and graphics_loop may
+        be coroutine functions (async def), and other tasks may be started
+        with asyncio.create_task from setup. See run_frames_async.
         
-        if self.demo:
-            draw = self.draw_demo
-        else:
-            draw = self.draw_murapix
+        The multiprocess mode and self.logic_fps are not available.
+        """
+        self.start_inputs()
+        self.start_dirty_detection()
+        if self.multiprocess:
+            print('Multiprocess mode is not available with run_async')
+        if self.logic_fps:
+            print('logic_fps is not available with run_async, frames are paced by self.fps')
+        self.start_frame_server()
+        asyncio.run(self._main_async())
+        self.close()
+    
+    async def _main_async(self):
+        loop = asyncio.get_running_loop()
+        #the signals only stop the loop, the output is closed by run_async
+        #once the frame being drawn is done
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            loop.add_signal_handler(sig, self.stop_async, sig)
+        executor = None
+        try:
+            await _maybe_await(self.setup())
+            draw = self.backend.draw
+            if self.pipelined:
+                draw = self.start_pipeline_draw(draw)
+            if self.backend.threadsafe:
+                executor = ThreadPoolExecutor(1, thread_name_prefix='murapix-output')
+            await self.run_frames_async(draw, executor)
+        finally:
+            if executor is not None:
+                executor.shutdown(wait=True)
+            for sig in (signal.SIGINT, signal.SIGTERM):
+                loop.remove_signal_handler(sig)
+                signal.signal(sig, self.quit_gracefully)
+    
+    def stop_async(self, sig):
+        print('\n### {} was catched, terminating ###'.format(signal.Signals(sig).name))
+        self.RUNNING = False
+    
+    async def run_frames_async(self, draw, executor=None):
+        """
+        Same as run_frames, as a coroutine: the hooks are awaited if they
+        are coroutine functions, the frames are paced with asyncio.sleep, and
+        draw, i.e. the remap and SwapOnVSync on the LED panels, runs in
+        executor (a concurrent.futures executor) if given, so other tasks run
+        meanwhile. They must not draw on self.scratch, as draw reads it.
+        """
+        loop = asyncio.get_running_loop()
+        if self.resolution is None and self.dynamic_resolution:
+            self.start_dynamic_resolution()
+        stats = self.stats
+        uncapped = self.backend.uncapped
+        gamepads = self.gamepads
+        t0 = deadline = perf_counter()
         while self.RUNNING:
+            if gamepads is not None:
+                gamepads.update()
+            await _maybe_await(self.logic_loop())
+            t1 = perf_counter()
+            await _maybe_await(self.graphics_loop())
+            self.finish_graphics()
+            t2 = perf_counter()
+            if executor is None:
+                draw()
+            else:
+                await loop.run_in_executor(executor, draw)
+            t3 = perf_counter()
+            if uncapped:
+                deadline = t3
+            else:
+                deadline += 1/self.fps
+                if deadline < t3:
+                    #late: start again from now rather than catching up
+                    deadline = t3
+            #lets the other tasks run, even when there is no time left
+            await asyncio.sleep(deadline-t3)
+            t4 = perf_counter()
+            stats.record('logic', t1-t0)
+            stats.record('graphics', t2-t1)
+            stats.record('idle', t4-t3)
+            stats.end_frame(t3-t0, self.fps)
+            if self.resolution is not None:
+                self.update_resolution(t3-t0)
+            self.dump_stats(t4)
+            t0 = t4
+    
+    def run_frames(self, draw):
+        """
+        Runs the game, outputing each frame with draw, until self.RUNNING is
+        set to False. Used by run(), and by the worker process in 
+        multiprocess mode.
+        """
+        if self.scheduler is None and self.logic_fps:
+            self.scheduler = FixedStepScheduler(self.logic_fps, self.fps)
+        if self.resolution is None and self.dynamic_resolution:
+            self.start_dynamic_resolution()
+        if self.scheduler is not None:
+            self.run_scheduled(draw)
+            return
+        stats = self.stats
+        uncapped = self.backend.uncapped
+        gamepads = self.gamepads
+        t0 = perf_counter()
+        while self.RUNNING:
+            if gamepads is not None:
+                gamepads.update()
             self.logic_loop()
+            t1 = perf_counter()
             self.graphics_loop()
+            self.finish_graphics()
+            t2 = perf_counter()
             draw()
-            self.clock.tick(self.fps)
-        
-        self.close()
+            t3 = perf_counter()
+            if uncapped:
+                self.clock.tick()
+            else:
+                self.clock.tick(self.fps)
+            t4 = perf_counter()
+            stats.record('logic', t1-t0)
+            stats.record('graphics', t2-t1)
+            stats.record('idle', t4-t3)
+            stats.end_frame(t3-t0, self.fps)
+            if self.resolution is not None:
+                self.update_resolution(t3-t0)
+            self.dump_stats(t4)
+            t0 = t4
+    
+    def run_multiprocess(self, draw):
+        """
+        Runs setup, logic_loop and graphics_loop in a worker process, while
+        this process outputs the frames with draw, see self.multiprocess
+        """
+        self.render_process = RenderProcess(self, draw, self.pipeline_depth)
+        self.render_process.start()
+        self.render_process.serve()
       
-    def draw_demo(self):
+    def run_scheduled(self, draw):
+        """
+        Main loop driven by self.scheduler: logic_loop at a fixed rate,
+        graphics_loop and draw at most self.fps times per second.
+        May be reused by a rewritten run().
+        """
+        scheduler = self.scheduler
+        stats = self.stats
+        graphics_loop = self.graphics_loop
+        takes_alpha = len(inspect.signature(graphics_loop).parameters) > 0
+        
+        def step():
+            t0 = perf_counter()
+            if self.gamepads is not None:
+                self.gamepads.update()
+            self.logic_loop()
+            stats.record('logic', perf_counter()-t0)
+        
+        def render(alpha):
+            self.alpha = alpha
+            t0 = perf_counter()
+            if takes_alpha:
+                graphics_loop(alpha)
+            else:
+                graphics_loop()
+            self.finish_graphics()
+            t1 = perf_counter()
+            draw()
+            t2 = perf_counter()
+            stats.record('graphics', t1-t0)
+            stats.end_frame(t2-t0, scheduler.render_rate)
+            if self.resolution is not None:
+                self.update_resolution(t2-t0)
+            self.dump_stats(t2)
+        
+        scheduler.run(lambda: self.RUNNING, step, render, stats)
+    
+    def dump_stats(self, now):
+        """
+        To be called once per frame by the main loops, now being
+        perf_counter(). Dumps self.stats to self.stats_dump every
+        self.stats_interval seconds, see self.stats_dump.
+        """
+        if not self.stats_dump:
+            return
+        if self._next_dump is None:
+            self._next_dump = now+self.stats_interval
+        if now > self._next_dump:
+            self.stats.dump(self.stats_dump)
+            self._next_dump = now+self.stats_interval
+    
+    def get_stats(self):
+        """
+        Returns a dict with the measured fps, the number of frames, the
+        number of frames which missed the budget of 1/self.fps, and for each
+        phase of the frame (logic, graphics, remap, convert, swap, idle...)
+        the p50, p95, p99 and mean duration in milliseconds over the last
+        frames.
+        """
+        return self.stats.summary()
+    
+    def draw_stats_overlay(self):
+        """
+        Draws the frame timings on the top of the largest rectangle of 
+        the murapix. The text is rendered once per second.
+        """
+        now = perf_counter()
+        if self._overlay is None or now > self._overlay[0]:
+            if self._overlay is None:
+                (left, top),(width, height) = get_largest_rect_add(self.led_rows,
+                                                                   self.mapping,
+                                                                   led_cols=self.led_cols)
+                font = self.text.font(max(8, self.led_rows//6))
+            else:
+                _, font, left, top, width, _ = self._overlay
+            text = font.render(self.stats.overlay_text(),
+                               False,
+                               (255,255,255),
+                               (0,0,0))
+            if text.get_width() > width:
+                text = text.subsurface((0, 0), (width, text.get_height()))
+            self._overlay = (now+1, font, left, top, width, text)
+        _, _, left, top, _, text = self._overlay
+        self.scratch.blit(text, (left, top))
+        self.mark_dirty(((left, top), text.get_size()))
+    
+    def start_pipeline(self, draw):
+        """
+        Starts the background thread outputing the frames with draw, see
+        self.pipelined
+        """
+        self.pipeline = OutputPipeline(draw, self.scratch, self.pipeline_depth,
+                                       self.dirty)
+        self.pipeline.start()
+    
+    def start_pipeline_draw(self, draw):
+        """
+        Starts the pipeline if the backend allows it, and returns the
+        function to draw the frames with
+        """
+        if not self.backend.threadsafe:
+            print('Pipelined mode is not available with the {} backend'.format(self.backend.name))
+            return draw
+        self.start_pipeline(draw)
+        return self.draw_pipelined
+    
+    def draw_pipelined(self):
+        #the marks go with the frame, the output thread may still be drawing
+        #the previous one
+        marks = self.dirty.take_marks() if self.dirty is not None else None
+        self.pipeline.submit(self.scratch, marks)
+    
+    def start_dirty_detection(self):
+        """
+        Starts tracking the panels which change, see self.dirty_detection
+        """
+        if self.dirty_detection:
+            self.dirty = DirtyPanels(self.remap, self.dirty_detection)
+        else:
+            self.dirty = None
+    
+    def start_frame_server(self):
+        """
+        Starts receiving the frames from the network, see self.listen
+        """
+        if self.listen and self.frame_server is None:
+            self.frame_server = FrameServer((self.width, self.height),
+                                            self.listen)
+            self.frame_server.start()
+            print('Listening for frames on {}:{}'.format(self.frame_server.protocol,
+                                                       self.frame_server.port))
+    
+    def finish_graphics(self):
+        """
+        Draws what goes over graphics_loop on self.scratch: the scrolling
+        texts, the layers, the frames received and the stats overlay. When
+        self.scratch is drawn at a lower render scale, it is first upscaled
+        to the full size if anything needs it.
+        """
+        if self.render_scale != 1 and self._needs_full_scratch():
+            self.upscale_scratch()
+        if self.marquee is not None:
+            self.draw_marquee()
+        if self.layers is not None:
+            self.compose_layers()
+        if self.frame_server is not None:
+            self.receive_frames()
+        if self.stats_overlay:
+            self.draw_stats_overlay()
+    
+    def _needs_full_scratch(self):
+        #only the remap of the backends knows how to upscale
+        return not (self.backend.scalable and self.dirty is None
+                    and self.pipeline is None and self.render_process is None
+                    and self.marquee is None and self.layers is None
+                    and self.frame_server is None and not self.stats_overlay)
+    
+    def start_dynamic_resolution(self):
+        """
+        Starts adjusting the render scale to the frame times, see 
+        self.dynamic_resolution
+        """
+        if self.dynamic_resolution:
+            self.resolution = ResolutionScaler(self.render_scales)
+        else:
+            self.resolution = None
+    
+    def _scaled_scratch(self, scale):
+        if scale == 1:
+            return self._full_scratch
+        surface = self._scaled_scratches.get(scale)
+        if surface is None:
+            size = scaled_size((self.width, self.height), scale)
+            if self.palette is None:
+                surface = pygame.Surface(size)
+            else:
+                surface = pygame.Surface(size, 0, 8)
+                surface.set_palette(self._full_scratch.get_palette())
+            self._scaled_scratches[scale] = surface
+        return surface
+    
+    def update_resolution(self, busy):
+        """
+        Adjusts the render scale to the time spent on the last frame, and
+        sets self.scratch to the surface of that scale for the next frame
+        """
+        previous = self._scaled_scratch(self.render_scale)
+        if self.resolution.update(busy, 1/self.fps if self.fps else 0):
+            self.render_scale = self.resolution.scale
+            surface = self._scaled_scratch(self.render_scale)
+            self.render_size = surface.get_size()
+            #the game may not redraw everything each frame
+            pygame.transform.scale(previous, self.render_size, surface)
+            if self.dirty is not None:
+                self.dirty.mark_all_dirty()
+        self.scratch = self._scaled_scratch(self.render_scale)
+    
+    def upscale_scratch(self):
+        """
+        Upscales self.scratch, drawn at self.render_scale, to the full size
+        surface, which becomes self.scratch until the next frame
+        """
+        t0 = perf_counter()
+        pygame.transform.scale(self.scratch, (self.width, self.height),
+                               self._full_scratch)
+        self.scratch = self._full_scratch
+        if self.dirty is not None:
+            self.dirty.mark_all_dirty()
+        self.stats.record('upscale', perf_counter()-t0)
+    
+    def set_palette(self, colors):
+        """
+        colors: list of up to 256 colors
+        
+        The first call switches self.scratch to an 8 bit surface drawn with
+        colors, see self.palette: less memory to fill, blit and remap. Its
+        content is kept, with the closest colors of the palette. The next
+        calls only change the palette, which is cheap: the pixels keep their
+        index in the palette, and all get their new color on the next frame.
+        """
+        colors = list(colors)
+        if self.indexed is None:
+            self.indexed = PaletteFrame(self.remap.size, colors)
+            scratch = pygame.Surface((self.width, self.height), 0, 8)
+            scratch.set_palette(self.indexed.surface.get_palette())
+            scratch.blit(self._full_scratch, (0, 0))
+            self._full_scratch = scratch
+            self._scaled_scratches = {}
+            self.scratch = self._scaled_scratch(self.render_scale)
+        else:
+            self.indexed.set_palette(colors)
+        self.palette = colors
+        palette = self.indexed.surface.get_palette()
+        for surface in [self._full_scratch]+list(self._scaled_scratches.values()):
+            surface.set_palette(palette)
+        if self.dirty is not None:
+            self.dirty.mark_all_dirty()
+    
+    def remap_frame(self, scratch, panels=None):
+        """
+        Remaps scratch onto self.frame, through self.indexed if scratch is
+        palettized.
+        
+        panels: optional list of indices in self.remap.panels, to remap only
+        those panels.
+        """
+        if self.indexed is None or scratch.get_bitsize() != 8:
+            self.remap.apply(scratch, self.frame, panels)
+            return
+        self.remap.apply(scratch, self.indexed, panels)
+        #the palette may have changed, all the panels are expanded
+        t0 = perf_counter()
+        self.indexed.expand(self.frame)
+        self.stats.record('expand', perf_counter()-t0)
+    
+    def add_layer(self, name, static=False, transparent=True):
+        """
+        Adds a layer of the size of self.scratch on top of the others and
+        returns it, see compositor.py. Draw on a static layer in setup, e.g.
+        a background, and on dynamic layers each frame, e.g.:
+            layer.erase()
+            layer.blit(sprite, position)
+        """
+        if self.layers is None:
+            self.layers = Compositor((self.width, self.height))
+        return self.layers.add_layer(name, static, transparent)
+    
+    def compose_layers(self):
+        """
+        Composites the areas of the layers which changed into self.scratch,
+        and reports them as dirty
+        """
+        t0 = perf_counter()
+        for rect in self.layers.compose(self.scratch):
+            self.mark_dirty(rect)
+        self.stats.record('compose', perf_counter()-t0)
+    
+    def add_ticker(self, size, rows=None, skip_deadzones=True, layer=None,
+                   **options):
+        """
+        Adds a text scrolling along the rows of panels and returns its
+        Ticker, see marquee.py and get_marquee_path. Messages are queued
+        with ticker.push(message).
+        
+        size: size of the font
+        rows: indices of the rows of the mapping the text goes through, by
+            default all of them, one after the other
+        skip_deadzones: if True, the text jumps over the dead zones
+        layer: name of the layer to draw on, see self.add_layer, by default
+            the text is drawn on self.scratch. Once layers are used, the
+            text must be drawn on one of them.
+        options: the other options of Ticker, e.g. speed or loop
+        """
+        path = get_marquee_path(self.mapping, self.led_rows, self.led_cols,
+                                rows, skip_deadzones)
+        if self.marquee is None:
+            self.marquee = Marquee()
+        options.setdefault('text', self.text)
+        if layer is not None:
+            layer = self.layers[layer]
+            options.setdefault('background', (0, 0, 0, 0))
+        return self.marquee.add(Ticker(path, size, **options), layer)
+    
+    def draw_marquee(self):
+        """
+        Moves the scrolling texts and draws them, see self.add_ticker
+        """
+        t0 = perf_counter()
+        self.marquee.step()
+        for rect in self.marquee.draw(self.scratch):
+            self.mark_dirty(rect)
+        self.stats.record('marquee', perf_counter()-t0)
+    
+    def receive_frames(self):
+        """
+        Blits on self.scratch the areas of the frames received since the 
+        last call, and reports them as dirty
+        """
+        t0 = perf_counter()
+        for rect in self.frame_server.apply(self.scratch):
+            self.mark_dirty(rect)
+        self.stats.record('ingest', perf_counter()-t0)
+    
+    def start_recording(self, path, keyframe_interval=60):
+        """
+        Records every frame, as sent to the LED panels, to path. The
+        recording can then be played by player.py without running the game.
+        It works in demo mode as well.
+        """
+        if getattr(self, 'frame', None) is None:
+            self.frame = ChainFrame(self.remap.size)
+        self.recorder = FrameRecorder(path, self.remap.size, self.fps,
+                                      keyframe_interval)
+    
+    def stop_recording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+    
+    def set_brightness(self, brightness):
+        """
+        Changes the brightness of the LED panels, in percent, from the next
+        frame on. Needs no color correction in the config file.
+        """
+        if self.color is None:
+            self.color = ColorCorrection(self.remap.size)
+        self.color.set_brightness(brightness)
+        if self.dirty is not None:
+            self.dirty.mark_all_dirty()
+    
+    def mark_dirty(self, rect):
+        """
+        Reports that the rect area of self.scratch changed, see 
+        self.dirty_detection
+        rect: anything pygame accepts as a rect, e.g. ((left, top), (width, height))
+        """
+        if self.dirty is None:
+            return
+        if self.render_process is not None and self.render_process.in_worker():
+            #passed on to the dirty detection of the parent process
+            self.render_process.mark_dirty(rect)
+        else:
+            self.dirty.mark_dirty(rect)
+    
+    def draw_demo(self, scratch=None):
+        if scratch is None:
+            scratch = self.scratch
+        if scratch.get_bitsize() == 8:
+            #the display and the led simulation take RGB pixels
+            if self._demo_rgb is None:
+                self._demo_rgb = pygame.Surface((self.width, self.height))
+            self._demo_rgb.blit(scratch, (0, 0))
+            scratch = self._demo_rgb
         demo = self.demo
         width = self.width
         height = self.height
-        pygame.transform.scale(self.scratch,
-                               (width*demo,height*demo),
-                               self._screen)
-        pygame.display.flip()
+        t0 = perf_counter()
+        if self.demo_style == 'scale':
+            pygame.transform.scale(scratch,
+                                   (width*demo,height*demo),
+                                   self._screen)
+            t1 = perf_counter()
+            pygame.display.flip()
+        else:
+            if self.led_simulator is None:
+                deadzones = get_deadzone_addresses(self.mapping, self.led_rows,
+                                                   self.led_cols)
+                self.led_simulator = LedSimulator(self.remap, demo, deadzones)
+            changed = None
+            if self.dirty is not None:
+                changed = self.dirty.update(scratch)
+            rects = self.led_simulator.render(scratch, self._screen, changed)
+            t1 = perf_counter()
+            if rects:
+                pygame.display.update(rects)
+        if self.recorder is not None:
+            self.remap_frame(scratch)
+            self.recorder.write(self.frame)
+        self.stats.record('scale', t1-t0)
+        self.stats.record('flip', perf_counter()-t1)
      
-    def draw_murapix(self):
-        scratch = self.scratch
-        screen = self._screen
-        mapping = self.mapping
-        led_rows = self.led_rows
-        led_cols = self.led_cols
-        parallel = self.parallel
-        curr_chain_row = 0
-        NoP_per_chain = int(self.max_number_of_panels/parallel)
+    def draw_murapix(self, scratch=None):
+        self.prepare_murapix(scratch)
+        self.swap_murapix()
+    
+    def prepare_murapix(self, scratch=None):
+        """
+        Remaps scratch and hands it to the next canvas, self.double_buffer, 
+        without showing it yet, see swap_murapix
+        """
+        if scratch is None:
+            scratch = self.scratch
+        
+        if self.dirty is not None:
+            self.prepare_murapix_dirty(scratch)
+            return
         
         #now blit each simulated panel in a row onto screen in the order 
-        #indicated by the mapping in the config file.   
-        #TODO: may be more efficient by vectorizing & using blits() instead of blit()
-        for i, n in enumerate(mapping):#x, rows
-            for j, m in enumerate(n):#y, panel number
-                if m is None:
-                    continue
-                #find in which chain "m" is
-                curr_chain_row = int((m-1)/NoP_per_chain)
-                
-                #print into a square that fits hzeller doc led addressing
-                #see https://github.com/hzeller/rpi-rgb-led-matrix/blob/master/wiring.md#chains                
-                screen.blit(scratch,#surface to take from
-                            #LED (row,col) on the lined up panels
-                            (led_rows*((m-(NoP_per_chain*curr_chain_row))-1),
-                             curr_chain_row*led_cols),
-                            #rectangle to extract from the width*height scratch surface
-                            area=pygame.Rect((led_rows*j,led_rows*i),
-                                             (led_rows,led_rows)))
-                
-                
+        #indicated by the mapping in the config file, all at once.
+        t0 = perf_counter()
+        self.remap_frame(scratch)
+        if self.recorder is not None:
+            self.recorder.write(self.frame)
+        frame = self.frame
+        t1 = perf_counter()
+        if self.color is not None:
+            frame = self.color.apply(frame)
         
-        py_im = pygame.image.tostring(screen, "RGB",False)
-        pil_im = Image.frombytes("RGB",screen.get_size(),py_im)
-        self.double_buffer.SetImage(pil_im)
-        self.matrix.SwapOnVSync(self.double_buffer)
+        #hand the RGB buffer to the canvas without intermediate copies
+        t2 = perf_counter()
+        frame.push(self.double_buffer)
+        stats = self.stats
+        stats.record('remap', t1-t0)
+        stats.record('color', t2-t1)
+        stats.record('convert', perf_counter()-t2)
+    
+    def prepare_murapix_dirty(self, scratch):
+        """
+        Same as prepare_murapix, only for the panels which changed
+        """
+        dirty = self.dirty
+        t0 = perf_counter()
+        changed = dirty.update(scratch)
+        if changed:
+            self.remap_frame(scratch, changed)
+        if self.recorder is not None:
+            self.recorder.write(self.frame)
+        t1 = perf_counter()
+        canvas = self.double_buffer
+        stale = dirty.stale()
+        size = (self.led_cols, self.led_rows)
+        panels = self.remap.panels
+        frame = self.frame
+        if self.color is not None:
+            if self.color.dithering:
+                #the dithering changes all panels on every frame
+                frame = self.color.apply(frame)
+                stale = panels
+            else:
+                frame = self.color.apply(frame, [(panels[k][1], size)
+                                                 for k in changed])
+        if len(stale) == len(panels):
+            frame.push(canvas)
+        else:
+            for k in stale:
+                frame.push_area(canvas, panels[k][1], size)
+        stats = self.stats
+        stats.record('remap', t1-t0)
+        stats.record('convert', perf_counter()-t1)
+    
+    def swap_murapix(self):
+        """
+        Shows the canvas prepared by prepare_murapix at the next refresh of
+        the LED panels
+        """
+        t0 = perf_counter()
+        self.double_buffer = self.matrix.SwapOnVSync(self.double_buffer)
+        self.stats.record('swap', perf_counter()-t0)
         
     def start_gamepad(self):
         assert os.path.isfile(self.gamepad), "self.gamepad must be a path to an SVG file"
         self.p = set_up_gamepad(self.gamepad)
+        self.start_hotplug()
         self.draw_select_gamepads()
-        pygame.joystick.quit()
-        pygame.joystick.init()
-        
+    
+    def start_hotplug(self):
+        """
+        Starts self.gamepads, watching the joysticks connecting and
+        disconnecting in the background
+        """
+        if self.gamepads is None:
+            self.gamepads = GamepadManager()
+        self.gamepads.start()
         
     def draw_select_gamepads(self):
-        rect_area = get_largest_rect_add(self.led_rows,self.mapping)
+        rect_area = get_largest_rect_add(self.led_rows,self.mapping,
+                                         led_cols=self.led_cols)
         ((left, top),(width, height)) = rect_area
         not_selected = True
-        no_gamepad = True
-        active_joystick = False
+        gamepads = self.gamepads
+        players = None
         fontsize = 3*width//18-1
         top = top + (height-fontsize*4)//2
-        font = pygame.font.Font(None, fontsize)
-        text = font.render("Players connected:",
-                           False,
-                           (255,255,255),
-                           (0,0,0))
-        text_end0 = font.render("Press any key",
-                                     False,
-                                     (255,255,255),
-                                     (0,0,0))
-        text_end1 = font.render(" to start",
-                                     False,
-                                     (255,255,255),
-                                     (0,0,0))
+        text = self.text
         
-        if self.demo:
-            draw = self.draw_demo
-        else:
-            draw = self.draw_murapix
+        draw = self.backend.draw
         
         while not_selected:
             self.clock.tick(self.fps)
-            NoJS = [x.startswith('js') for x in os.listdir("/dev/input")].count(True)
-            
-            text_NoP = font.render(str(NoJS),
-                                         False,
-                                         (255,255,255),
-                                         (0,0,0))
-            if NoJS>0 and no_gamepad:
-                no_gamepad = False
-                pygame.joystick.quit()
-                pygame.joystick.init()
-                active_joystick = pygame.joystick.Joystick(0)
-                active_joystick.init()
-            
-            
             for event in pygame.event.get():
-                if (active_joystick and event.type == pgl.JOYBUTTONDOWN):
+                gamepads.handle_event(event)
+                if (gamepads.count and event.type == pgl.JOYBUTTONDOWN):
                     not_selected = False
-                    print('{} players selected'.format(NoJS))
+                    print('{} players selected'.format(gamepads.count))
+            gamepads.update()
+            if gamepads.count == players:
+                #nothing changed, the panels keep showing the last frame
+                continue
+            players = gamepads.count
             
-            
-            tw , th = font.size("Players connected:")
-            self.scratch.blit(text,(left+(width-tw)//2,top))
-            self.scratch.blit(text_NoP,(left+width//2,top+1*fontsize))
-            tw , th = font.size("Press any key")
-            self.scratch.blit(text_end0,(left+(width-tw)//2,top+2*fontsize))
-            tw , th = font.size(" to start")
-            self.scratch.blit(text_end1,(left+(width-tw)//2,top+3*fontsize))
+            lines = ("Players connected:", None, "Press any key", " to start")
+            self.scratch.fill((0,0,0),(left,top+1*fontsize,width,fontsize))
+            for k, line in enumerate(lines):
+                if line is None:
+                    text.draw_glyphs(self.scratch, str(players),
+                                     (left+width//2,top+k*fontsize),
+                                     fontsize, background=(0,0,0))
+                    continue
+                tw , th = text.size(line, fontsize)
+                text.draw(self.scratch, line, (left+(width-tw)//2,top+k*fontsize),
+                          fontsize, background=(0,0,0))
+            self.mark_dirty((left,top,width,4*fontsize))
             draw()
     
     def close(self):
         #https://stackoverflow.com/questions/2638909/killing-a-subprocess-including-its-children-from-python
         
+        if self.render_process is not None:
+            if self.render_process.in_worker():
+                #the parent process owns the output
+                self.RUNNING = False
+                sys.exit()
+            self.render_process.stop()
+        if self.gamepads is not None:
+            self.gamepads.stop()
+        if self.pipeline is not None:
+            self.pipeline.stop()
+        if self.frame_server is not None:
+            self.frame_server.stop()
+        self.stop_recording()
+        self.backend.close()
+            
         if self.gamepad:
             try:
                 os.killpg(os.getpgid(self.p.pid), signal.SIGTERM)
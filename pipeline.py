@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Pipelined output of the murapix frames.
+
+The game thread renders frame N+1 on self.scratch while a dedicated output
+thread remaps and swaps frame N on the LED panels. Frames are handed over
+through a small ring of scratch surfaces:
+    - the game thread copies self.scratch onto a free surface of the ring
+      and queues it,
+    - the output thread draws the queued surfaces in order and gives them
+      back to the ring.
+When the output is slower than the game, no surface is free and the game
+thread waits for one (backpressure) instead of piling up frames.
+"""
+import queue
+import threading
+import pygame
+
+
+class OutputPipeline:
+    """
+    draw: function drawing a scratch surface on the output,
+        e.g. Murapix.draw_murapix
+    scratch: the surface the frames are rendered on, used to create the ring
+        with the same size and pixel format
+    depth: number of surfaces in the ring
+    dirty: optional DirtyPanels of the murapix, the marks handed over with
+        each frame are given to it right before the frame is drawn
+    """
+    def __init__(self, draw, scratch, depth=3, dirty=None):
+        assert depth > 1, "the ring needs at least 2 surfaces"
+        self.draw = draw
+        self.depth = depth
+        self.dirty = dirty
+        self.error = None
+        self._stopping = False
+        self._free = queue.Queue()
+        self._ready = queue.Queue()
+        for _ in range(depth):
+            self._free.put(pygame.Surface(scratch.get_size(), 0, scratch))
+        self._thread = threading.Thread(target=self._output_loop,
+                                        name='murapix-output',
+                                        daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def submit(self, scratch, marks=None):
+        """
+        Queues a copy of scratch to be drawn by the output thread. Waits for
+        a free surface of the ring if the output thread is behind.
+        
+        marks: the panels marked dirty on this frame, see 
+        DirtyPanels.take_marks
+        """
+        while True:
+            if not self._thread.is_alive():
+                raise RuntimeError("murapix output thread stopped") from self.error
+            try:
+                surface = self._free.get(timeout=0.1)
+                break
+            except queue.Empty:
+                continue
+        if surface.get_bitsize() != scratch.get_bitsize():
+            #the format of scratch changed, e.g. with Murapix.set_palette
+            surface = pygame.Surface(scratch.get_size(), 0, scratch)
+        if scratch.get_bitsize() == 8:
+            #same palette, so that the indices are copied as they are
+            surface.set_palette(scratch.get_palette())
+        surface.blit(scratch, (0, 0))
+        self._ready.put((surface, marks))
+
+    def _output_loop(self):
+        while True:
+            item = self._ready.get()
+            if item is None:
+                break
+            surface, marks = item
+            try:
+                if marks is not None and self.dirty is not None:
+                    self.dirty.hand_over(marks)
+                if not self._stopping:
+                    self.draw(surface)
+            except Exception as e:
+                self.error = e
+                print("Error in murapix output thread")
+                print(e)
+                break
+            finally:
+                self._free.put(surface)
+
+    def stop(self, timeout=1.0):
+        """
+        Stops the output thread once the frame being drawn is done. Frames
+        still queued are dropped.
+        """
+        self._stopping = True
+        self._ready.put(None)
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join(timeout)
@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Plays a recording made with Murapix.start_recording (or the "record"
+backend) on the murapix, at full speed and without running any game code:
+the recorded frames are already in the LED chain layout and are streamed
+straight to the canvas.
+
+How to use:
+    python3 player.py config.ini recording.mpxr [--demo=3] [--loop] [--fps=60] [--seek=FRAME]
+
+--fps overrides the frame rate the recording was made at, --seek starts
+from the given frame, --loop plays the recording again and again.
+The config file must describe the murapix the recording was made for.
+"""
+
+from murapix import Murapix
+from recording import FramePlayer
+from remap import ChainFrame
+from scheduler import sleep_until
+import pygame
+import pygame.locals as pgl
+import sys
+from time import perf_counter
+
+
+def process_player_arg(argv):
+    """
+    Returns the arguments left for Murapix, the path to the recording, and a
+    dict with the loop, fps and seek options.
+    """
+    murapix_argv = argv[:1]
+    recording = None
+    options = {'loop': False, 'fps': None, 'seek': 0}
+    for arg in argv[1:]:
+        if arg == '--loop':
+            options['loop'] = True
+        elif arg.startswith('--fps='):
+            options['fps'] = float(arg.split('=')[1])
+        elif arg.startswith('--seek='):
+            options['seek'] = int(arg.split('=')[1])
+        elif arg.startswith('--') or len(murapix_argv) < 2:
+            murapix_argv.append(arg)
+        else:
+            recording = arg
+    assert recording is not None, "needs a path to the recording after the config file"
+    return murapix_argv, recording, options
+
+
+class Player(Murapix):
+    def __init__(self, argv=None):
+        if argv is None:
+            argv = sys.argv
+        murapix_argv, recording, options = process_player_arg(argv)
+        super(Player, self).__init__(murapix_argv)
+        self.player = FramePlayer(recording)
+        err_mess = "The recording was made for another murapix layout"
+        assert self.player.size == self.remap.size, err_mess
+        if getattr(self, 'frame', None) is None:
+            self.frame = ChainFrame(self.remap.size)
+        self.loop = options['loop']
+        self.fps = options['fps'] or self.player.fps
+        self.player.seek(options['seek'])
+
+    def run(self):
+        player = self.player
+        frame = self.frame
+        stats = self.stats
+        on_leds = self.backend.name == 'hzeller'
+        uncapped = self.backend.uncapped
+        next_frame = perf_counter()
+        while self.RUNNING:
+            t0 = perf_counter()
+            if not player.read(frame):
+                if not self.loop:
+                    break
+                player.seek(0)
+                continue
+            if on_leds:
+                if self.color is not None:
+                    #into another buffer, the player decodes the next frame
+                    #from this one
+                    self.color.apply(frame).push(self.double_buffer)
+                else:
+                    frame.push(self.double_buffer)
+                self.double_buffer = self.matrix.SwapOnVSync(self.double_buffer)
+            else:
+                for event in pygame.event.get():
+                    if event.type == pgl.QUIT:
+                        self.RUNNING = False
+                self.remap.unapply(frame, self.scratch)
+                self.backend.draw()
+            t1 = perf_counter()
+            stats.end_frame(t1-t0, self.fps)
+            if not uncapped:
+                next_frame += 1/self.fps
+                if next_frame < t1:
+                    next_frame = t1
+                sleep_until(next_frame)
+        player.close()
+        self.close()
+
+
+def main():
+
+  Player().run()
+
+if __name__ == '__main__':
+  main()
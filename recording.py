@@ -0,0 +1,166 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Recording and playback of remapped murapix frames.
+
+FrameRecorder captures the frames in the hzeller chain layout, i.e. as they
+are handed to the canvas, in a compact file:
+    - a header: magic "MPXR", version, width, height, number of frames,
+      frames per second and position of the index,
+    - the frames: a key frame (raw RGB, so it can be copied as is) every
+      keyframe_interval frames, and in between delta frames, i.e. the zlib
+      compressed XOR with the previous frame, which is mostly zeros for
+      animations where little changes,
+    - the index: position, kind and length of each frame.
+
+FramePlayer memory-maps such a file and decodes the frames one after the
+other into a preallocated buffer, seeking from the closest key frame.
+See player.py to play a recording on the murapix without any game code.
+"""
+import mmap
+import struct
+import zlib
+
+
+MAGIC = b'MPXR'
+VERSION = 1
+HEADER = struct.Struct('<4sBHHIfQ')
+INDEX_ENTRY = struct.Struct('<QBI')
+KEY_FRAME = 0
+DELTA_FRAME = 1
+
+
+class FrameRecorder:
+    """
+    path: path of the file to write
+    size: (width, height) of the chain frames
+    fps: frames per second the recording is meant to be played at
+    keyframe_interval: a key frame is written every keyframe_interval frames
+    level: zlib compression level of the delta frames
+    """
+    def __init__(self, path, size, fps, keyframe_interval=60, level=1):
+        import numpy as np
+        width, height = size
+        self.path = path
+        self.size = (width, height)
+        self.fps = fps
+        self.keyframe_interval = keyframe_interval
+        self.level = level
+        self.count = 0
+        self._index = []
+        self._previous = np.zeros(width*height*3, dtype=np.uint8)
+        self._delta = np.empty_like(self._previous)
+        self._file = open(path, 'wb')
+        self._file.write(HEADER.pack(MAGIC, VERSION, width, height, 0, fps, 0))
+
+    def write(self, frame):
+        """
+        frame: ChainFrame, or any buffer of packed RGB pixels of self.size
+        """
+        import numpy as np
+        buffer = getattr(frame, 'buffer', frame)
+        current = np.frombuffer(buffer, dtype=np.uint8)
+        if self.count % self.keyframe_interval == 0:
+            kind = KEY_FRAME
+            payload = buffer
+        else:
+            kind = DELTA_FRAME
+            np.bitwise_xor(current, self._previous, out=self._delta)
+            payload = zlib.compress(self._delta, self.level)
+        self._previous[...] = current
+        self._index.append((self._file.tell(), kind, len(payload)))
+        self._file.write(payload)
+        self.count += 1
+
+    def close(self):
+        if self._file is None:
+            return
+        index_offset = self._file.tell()
+        for entry in self._index:
+            self._file.write(INDEX_ENTRY.pack(*entry))
+        self._file.seek(0)
+        width, height = self.size
+        self._file.write(HEADER.pack(MAGIC, VERSION, width, height,
+                                     self.count, self.fps, index_offset))
+        self._file.close()
+        self._file = None
+
+
+class FramePlayer:
+    """
+    path: path of a file written by FrameRecorder
+
+    FramePlayer has the following properties:
+        self.size: (width, height) of the chain frames
+        self.fps: frames per second the recording was made for
+        self.count: the number of frames
+        self.position: index of the next frame to be read
+    """
+    def __init__(self, path):
+        self._file = open(path, 'rb')
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+        (magic, version, width, height,
+         count, fps, index_offset) = HEADER.unpack_from(self._map, 0)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(path+" is not a murapix recording")
+        if not index_offset:
+            raise ValueError(path+" was not closed properly")
+        self.size = (width, height)
+        self.fps = fps
+        self.count = count
+        self.index = [INDEX_ENTRY.unpack_from(self._map,
+                                              index_offset+k*INDEX_ENTRY.size)
+                      for k in range(count)]
+        self.position = 0
+        #last buffer decoded into, holding the frame before _decoded_next
+        self._decoded = None
+        self._decoded_next = 0
+
+    def _decode(self, buffer, k):
+        import numpy as np
+        offset, kind, length = self.index[k]
+        payload = self._view[offset:offset+length]
+        if kind == KEY_FRAME:
+            buffer[:] = payload
+        else:
+            current = np.frombuffer(buffer, dtype=np.uint8)
+            np.bitwise_xor(current, np.frombuffer(zlib.decompress(payload),
+                                                  dtype=np.uint8),
+                           out=current)
+
+    def seek(self, position):
+        """
+        Sets the next frame to be read
+        """
+        if not 0 <= position < self.count:
+            raise IndexError("frame {} out of 0..{}".format(position, self.count-1))
+        self.position = position
+
+    def read(self, frame):
+        """
+        Decodes the next frame into frame, a ChainFrame or a writable buffer
+        of self.size packed RGB pixels. Returns False at the end of the
+        recording.
+        """
+        if self.position >= self.count:
+            return False
+        buffer = getattr(frame, 'buffer', frame)
+        position = self.position
+        start = position
+        if self._decoded is not buffer or self._decoded_next != position:
+            #decode from the closest key frame, unless buffer already holds
+            #the previous frame
+            while self.index[start][1] != KEY_FRAME:
+                start -= 1
+        for k in range(start, position+1):
+            self._decode(buffer, k)
+        self._decoded = buffer
+        self._decoded_next = position+1
+        self.position = position+1
+        return True
+
+    def close(self):
+        self._view.release()
+        self._map.close()
+        self._file.close()
@@ -0,0 +1,589 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Precomputed remap from the murapix config layout to the hzeller chain layout.
+
+The scratch surface drawn by the games is laid out as in the config file
+(width*height pixels, one led_cols*led_rows square per panel, holes
+included). The LED matrices are driven by hzeller library as `parallel`
+chains of panels lined up one after the other, see
+https://github.com/hzeller/rpi-rgb-led-matrix/blob/master/wiring.md#chains
+
+PanelRemap computes once which area of the scratch surface goes where on the
+chain surface, so that each frame can be remapped in a single batched call.
+
+Panels may be mounted rotated or mirrored, e.g. upside down to shorten the
+cables. The upright panels are still remapped in a single batched call, and
+each of the other panels with a single strided copy of its pixels, reversed
+and transposed as precomputed from its orientation.
+"""
+import pygame
+
+
+#how a panel may be mounted: function giving the position on the wall of the
+#led (x, y) of a panel of size (w, h), working on numpy arrays as well.
+ORIENTATIONS = {'rot0': lambda x, y, w, h: (x, y),
+                'rot90': lambda x, y, w, h: (h-1-y, x),
+                'rot180': lambda x, y, w, h: (w-1-x, h-1-y),
+                'rot270': lambda x, y, w, h: (y, w-1-x),
+                'flip-x': lambda x, y, w, h: (w-1-x, y),
+                'flip-y': lambda x, y, w, h: (x, h-1-y)}
+
+
+def parse_orientation(orientation, led_rows, led_cols):
+    """
+    orientation: names of ORIENTATIONS joined by "+", applied from left to
+    right, e.g. "rot180" or "rot90+flip-x"
+    
+    returns the tuple of names
+    """
+    names = tuple(o.strip() for o in orientation.split('+'))
+    for name in names:
+        if name not in ORIENTATIONS:
+            raise ValueError('Orientation must be one of {}. {} was entered'.format(
+                ', '.join(sorted(ORIENTATIONS)), name))
+        if name in ('rot90', 'rot270'):
+            assert led_rows == led_cols, "Only square panels can be rotated by 90 degrees"
+    return names
+
+
+class PanelRemap:
+    """
+    Remap table from the config layout to the hzeller chain layout.
+
+    It is built once from the mapping and can be shared by every output path
+    needing the chain layout.
+
+    PanelRemap has the following properties:
+        self.size: (width, height) in pixel of the chain surface
+        self.scratch_size: (width, height) in pixel of the scratch surface
+        self.panels_per_chain: the number of panels on each chain
+        self.panels: list of (panel number, dest, area) where dest is the
+            (left, top) position on the chain surface and area the pygame.Rect
+            to extract from the scratch surface
+        self.orientations: dict of panel number: tuple of ORIENTATIONS names,
+            for the panels which are not mounted upright
+    
+    orientation: optional dict of panel number: orientation, see
+        parse_orientation
+    """
+    def __init__(self, mapping, led_rows, led_cols, parallel=1,
+                 orientation=None):
+        number_of_panels = sum(m is not None for n in mapping for m in n)
+        panels_per_chain = number_of_panels//parallel
+        self.led_rows = led_rows
+        self.led_cols = led_cols
+        self.parallel = parallel
+        self.panels_per_chain = panels_per_chain
+        self.size = (panels_per_chain*led_cols, parallel*led_rows)
+        self.scratch_size = (len(mapping[0])*led_cols, len(mapping)*led_rows)
+        self.panels = []
+        for i, n in enumerate(mapping):#x, rows
+            for j, m in enumerate(n):#y, panel number
+                if m is None:
+                    continue
+                #find in which chain "m" is
+                chain_row = (m-1)//panels_per_chain
+                #LED (row,col) on the lined up panels
+                dest = (led_cols*(m-1-panels_per_chain*chain_row),
+                        led_rows*chain_row)
+                #rectangle to extract from the width*height scratch surface
+                area = pygame.Rect((led_cols*j, led_rows*i),
+                                   (led_cols, led_rows))
+                self.panels.append((m, dest, area))
+        self.panels.sort(key=lambda p: p[0])
+        self.orientations = {}
+        for m, o in (orientation or {}).items():
+            names = parse_orientation(o, led_rows, led_cols)
+            if any(name != 'rot0' for name in names):
+                self.orientations[m] = names
+        #indices in self.panels of the upright panels, remapped with blits
+        self._upright = [k for k, (m, _, _) in enumerate(self.panels)
+                         if m not in self.orientations]
+        #indices in self.panels of the other ones: how to copy them
+        self._oriented = None
+        self._blits = {}
+        self._index = None
+        self._staging = None
+        #by scratch size, for scratch surfaces drawn at a lower resolution
+        self._scaled_index = {}
+        #by (scratch size, palettized), the pixels of scratch in row order
+        self._flat = {}
+
+    def blit_sequence(self, scratch):
+        """
+        Returns the sequence to give to pygame.Surface.blits to remap scratch.
+        It is cached for the last few scratch surfaces given.
+        """
+        blits = self._blits.get(scratch)
+        if blits is None:
+            if len(self._blits) > 3:
+                self._blits.clear()
+            blits = [(scratch, dest, area) for _, dest, area in self.panels]
+            self._blits[scratch] = blits
+        return blits
+
+    def forget(self):
+        """
+        Drops the cached blit sequences, and with them the scratch surfaces
+        they hold, e.g. before releasing the memory of those surfaces
+        """
+        self._blits.clear()
+
+    def blit(self, scratch, screen, panels=None):
+        """
+        Remaps the scratch surface onto the chain surface screen in a single
+        Surface.blits call.
+        
+        panels: optional list of indices in self.panels, to remap only
+        those panels.
+        """
+        blits = self.blit_sequence(scratch)
+        if panels is not None:
+            blits = [blits[k] for k in panels]
+        screen.blits(blits, doreturn=False)
+
+    @property
+    def index(self):
+        """
+        Flat index permutation of the remap, as a numpy array of intp.
+
+        index[k] is the flat index (top*width+left) in the scratch surface of
+        the k-th pixel of the chain surface, in row major order. Pixels of
+        the chain surface which are not covered by a panel point to 0.
+        """
+        if self._index is None:
+            import numpy as np
+            width, height = self.size
+            scratch_width = self.scratch_size[0]
+            index = np.zeros((height, width), dtype=np.intp)
+            for m, (left, top), area in self.panels:
+                ys, xs = np.mgrid[0:area.height, 0:area.width]
+                for name in self.orientations.get(m, ()):
+                    xs, ys = ORIENTATIONS[name](xs, ys, area.width, area.height)
+                index[top:top+area.height,
+                      left:left+area.width] = ((area.top+ys)*scratch_width
+                                               + area.left+xs)
+            self._index = index.reshape(-1)
+        return self._index
+
+    def gather(self, source, out=None):
+        """
+        Remaps in one vectorized gather.
+
+        source: numpy array whose first axis is the flat pixel index of the
+        scratch surface, e.g. of shape (height*width, 3) for RGB pixels.
+        out: optional preallocated array of shape (len(self.index),)+source.shape[1:]
+
+        returns the pixels of the chain surface, in row major order.
+        """
+        import numpy as np
+        #the indices are all valid, clip avoids buffering out
+        return np.take(source, self.index, axis=0, out=out, mode='clip')
+
+    def scaled_index(self, size):
+        """
+        Same as self.index, for a scratch surface of size (width, height)
+        drawn at a lower resolution: the upscale to self.scratch_size, with
+        nearest neighbour sampling, is folded into the permutation.
+        """
+        index = self._scaled_index.get(size)
+        if index is None:
+            import numpy as np
+            width, height = size
+            scratch_width, scratch_height = self.scratch_size
+            ys, xs = np.divmod(self.index, scratch_width)
+            index = (ys*height//scratch_height)*width + xs*width//scratch_width
+            if len(self._scaled_index) > 3:
+                self._scaled_index.clear()
+                self._flat.clear()
+            self._scaled_index[size] = index
+        return index
+
+    def flat_pixels(self, scratch):
+        """
+        Returns the pixels of scratch in row order, for a gather: a numpy
+        array of shape (height*width, 3) of RGB pixels, or (height*width,)
+        of palette indices for an 8 bit surface. It is overwritten by the
+        next call.
+        """
+        import numpy as np
+        width, height = size = scratch.get_size()
+        palettized = scratch.get_bitsize() == 8
+        key = (size, palettized)
+        staging = self._flat.get(key)
+        if palettized:
+            if staging is None:
+                staging = self._flat[key] = np.empty((height, width), dtype=np.uint8)
+            #the indices as they are, whatever the palette
+            staging[...] = pygame.surfarray.pixels2d(scratch).T
+            return staging.reshape(-1)
+        if staging is None:
+            staging = self._flat[key] = ChainFrame(size)
+        staging.surface.blit(scratch, (0, 0))
+        return staging.array.reshape((-1, 3))
+
+    def _oriented_panels(self):
+        """
+        Returns the dict of index in self.panels: (dest, source, transpose,
+        steps) of the panels which are not upright. dest is the (rows, cols)
+        slices of the panel on the chain surface, source the (x, y) slices
+        of its area on the scratch surface. Any orientation is a transpose
+        or not followed by reversing some axes: steps are the steps (1 or
+        -1) of the (rows, cols) of the area, once transposed to (y, x) if
+        transpose is True.
+        """
+        if self._oriented is None:
+            import numpy as np
+            oriented = {}
+            for k, (m, (left, top), area) in enumerate(self.panels):
+                if m not in self.orientations:
+                    continue
+                ys, xs = np.mgrid[0:area.height, 0:area.width]
+                for name in self.orientations[m]:
+                    xs, ys = ORIENTATIONS[name](xs, ys, area.width, area.height)
+                #the led (x, y) of the chain surface shows the pixel
+                #(xs[y, x], ys[y, x]) of the area
+                transpose = area.width == 1 or xs[0, 0] != xs[0, 1]
+                rows, cols = (ys, xs) if transpose else (xs, ys)
+                steps = (-1 if area.height > 1 and rows[1, 0] < rows[0, 0] else 1,
+                         -1 if area.width > 1 and cols[0, 1] < cols[0, 0] else 1)
+                oriented[k] = ((slice(top, top+area.height),
+                                slice(left, left+area.width)),
+                               (slice(area.left, area.right),
+                                slice(area.top, area.bottom)),
+                               transpose, steps)
+            self._oriented = oriented
+        return self._oriented
+
+    def apply(self, scratch, frame, panels=None):
+        """
+        Remaps the scratch surface onto frame, a ChainFrame, or a
+        PaletteFrame for an 8 bit scratch surface.
+        
+        panels: optional list of indices in self.panels, to remap only
+        those panels.
+        
+        The upright panels are remapped with a single Surface.blits call, see
+        self.blit. Each panel which is rotated or mirrored is then copied
+        with a numpy view of its area, see self._oriented_panels.
+        
+        scratch may be smaller than self.scratch_size, when drawn at a lower
+        resolution: it is then upscaled and all the panels are remapped in a
+        single gather, see self.scaled_index.
+        """
+        if scratch.get_size() != self.scratch_size:
+            import numpy as np
+            array = frame.array
+            np.take(self.flat_pixels(scratch), self.scaled_index(scratch.get_size()),
+                    axis=0, out=array.reshape((-1,)+array.shape[2:]), mode='clip')
+            return
+        if not self.orientations:
+            self.blit(scratch, frame.surface, panels)
+            return
+        orientations = self._oriented_panels()
+        if panels is None:
+            upright = self._upright
+            oriented = list(orientations)
+        else:
+            upright = [k for k in panels if k not in orientations]
+            oriented = [k for k in panels if k in orientations]
+        if upright:
+            self.blit(scratch, frame.surface, upright)
+        if not oriented:
+            return
+        if scratch.get_bitsize() == 8:
+            pixels = pygame.surfarray.pixels2d(scratch)
+        else:
+            pixels = pygame.surfarray.pixels3d(scratch)
+        array = frame.array
+        for k in oriented:
+            dest, source, transpose, (row_step, col_step) = orientations[k]
+            area = pixels[source]
+            if transpose:
+                area = area.swapaxes(0, 1)
+            array[dest] = area[::row_step, ::col_step]
+        #unlocks scratch
+        del pixels
+
+    def unapply(self, frame, scratch):
+        """
+        Inverse of apply: puts back the panels of the ChainFrame frame onto
+        the scratch surface, e.g. to show a recorded frame in demo mode.
+        """
+        staging = self._staging
+        if staging is None:
+            staging = self._staging = ChainFrame(self.scratch_size)
+        staging.array.reshape((-1, 3))[self.index] = frame.array.reshape((-1, 3))
+        scratch.blit(staging.surface, (0, 0))
+
+
+class ChainFrame:
+    """
+    Preallocated RGB frame in the hzeller chain layout.
+
+    self.buffer is a bytearray holding the packed RGB888 pixels row after row.
+    self.surface is a pygame surface sharing the memory of self.buffer, so
+    remapping onto it (e.g. with PanelRemap.blit) writes directly into the
+    buffer, and self.array is a (height, width, 3) numpy view of it.
+    Nothing is allocated when a frame is pushed to a canvas.
+    """
+    #a binding exposing this method takes the packed RGB buffer directly:
+    #canvas.SetImageBuffer(buffer, width, height)
+    BUFFER_ENTRY_POINT = 'SetImageBuffer'
+
+    def __init__(self, size):
+        width, height = size
+        self.size = (width, height)
+        self.buffer = bytearray(width*height*3)
+        self.surface = pygame.image.frombuffer(self.buffer, self.size, 'RGB')
+        self._array = None
+        self._image = None
+        self._area_images = {}
+
+    @property
+    def array(self):
+        """
+        (height, width, 3) uint8 numpy view of self.buffer
+        """
+        if self._array is None:
+            import numpy as np
+            width, height = self.size
+            self._array = np.frombuffer(self.buffer,
+                                        dtype=np.uint8).reshape((height,
+                                                                 width, 3))
+        return self._array
+
+    @property
+    def image(self):
+        """
+        PIL image reused to hand the frame to bindings having only SetImage
+        """
+        if self._image is None:
+            from PIL import Image
+            self._image = Image.new("RGB", self.size)
+        return self._image
+
+    def push(self, canvas):
+        """
+        Hands the frame to a hzeller FrameCanvas.
+
+        Uses the buffer entry point when the binding has one, else falls back
+        to SetImage with a PIL image decoded in place from the buffer.
+        """
+        set_buffer = getattr(canvas, self.BUFFER_ENTRY_POINT, None)
+        if set_buffer is not None:
+            set_buffer(self.buffer, *self.size)
+        else:
+            image = self.image
+            image.frombytes(self.buffer)
+            canvas.SetImage(image)
+
+    def push_area(self, canvas, dest, size):
+        """
+        Hands the area of the frame at dest=(left, top) of size=(width, height)
+        to a hzeller FrameCanvas, with SetImage at an offset.
+        """
+        image = self._area_images.get(size)
+        if image is None:
+            from PIL import Image
+            image = self._area_images[size] = Image.new("RGB", size)
+        left, top = dest
+        stride = 3*self.size[0]
+        image.frombytes(memoryview(self.buffer)[top*stride+3*left:],
+                        "raw", "RGB", stride)
+        canvas.SetImage(image, left, top)
+
+
+class PaletteFrame:
+    """
+    Preallocated 8 bit frame in the hzeller chain layout, for the
+    palettized scratch surfaces: it holds palette indices, 1 byte per LED
+    rather than 3.
+
+    self.surface is an 8 bit pygame surface sharing the memory of
+    self.buffer. It has the palette of the scratch surface, so that the
+    remap copies the indices as they are. expand then writes the RGB pixels
+    into a ChainFrame with a single lookup of every index in the palette.
+
+    palette: list of up to 256 colors, gray levels by default
+    """
+    def __init__(self, size, palette=None):
+        width, height = size
+        self.size = (width, height)
+        self.buffer = bytearray(width*height)
+        self.surface = pygame.image.frombuffer(self.buffer, self.size, 'P')
+        self._array = None
+        self.set_palette(palette or [(i, i, i) for i in range(256)])
+
+    @property
+    def array(self):
+        """
+        (height, width) uint8 numpy view of self.buffer
+        """
+        if self._array is None:
+            import numpy as np
+            width, height = self.size
+            self._array = np.frombuffer(self.buffer,
+                                        dtype=np.uint8).reshape((height, width))
+        return self._array
+
+    def set_palette(self, palette):
+        """
+        palette: list of up to 256 colors, the missing ones being black.
+        Sets self.colors, the list of the 256 (r, g, b) colors of the
+        palette, and the palette of self.surface.
+        """
+        assert 0 < len(palette) <= 256, "a palette has 1 to 256 colors"
+        colors = [tuple(pygame.Color(c))[:3] for c in palette]
+        self.colors = colors+[(0, 0, 0)]*(256-len(colors))
+        self.surface.set_palette(self.colors)
+
+    def expand(self, frame):
+        """
+        Writes the RGB pixels of the frame into the ChainFrame frame
+        """
+        #SDL looks the indices up in the palette in a single pass, faster
+        #than a numpy gather which needs the indices as intp first
+        frame.surface.blit(self.surface, (0, 0))
+
+
+def _pixels(surface):
+    """
+    numpy view of the pixels of a surface, of shape (width, height) or
+    (width, height, 3) for 24 bits surfaces
+    """
+    if surface.get_bytesize() == 3:
+        return pygame.surfarray.pixels3d(surface)
+    return pygame.surfarray.pixels2d(surface)
+
+
+class DirtyPanels:
+    """
+    Tracks which panels of the scratch surface changed, so that only those
+    are remapped and sent to the canvases.
+    
+    remap: the PanelRemap of the murapix
+    mode: 
+        "auto": each panel of the scratch surface is compared to the 
+        previous frame
+        "manual": only the panels reported with mark_dirty are updated
+    
+    As hzeller canvases are double buffered, the canvas being prepared gets
+    all the panels which changed since it was last drawn, two frames ago,
+    see stale.
+    
+    When the frames are drawn by another thread than the game, see 
+    OutputPipeline, the panels marked on each frame are handed over with
+    it: take_marks on the game thread, hand_over on the output thread.
+    
+    DirtyPanels has the following properties:
+        self.skipped: the number of panels which were not sent to the canvas
+            on the last frame
+        self.total_skipped: the number of panels skipped since the start
+    """
+    def __init__(self, remap, mode='auto'):
+        if mode not in ('auto', 'manual'):
+            raise ValueError('Mode must be "auto" or "manual". {} was entered'.format(mode))
+        self.remap = remap
+        self.mode = mode
+        self.frame = 0
+        self.skipped = 0
+        self.total_skipped = 0
+        number_of_panels = len(remap.panels)
+        #frame number when each panel last changed, all panels are reported
+        #as changed on the first frame
+        self._stamps = [0]*number_of_panels
+        self._manual = set(range(number_of_panels))
+        #output thread side, the marks of the frame being drawn once they are
+        #handed over with the frames
+        self._handed = None
+        self._previous = None
+        self._diff = None
+
+    def mark_dirty(self, rect):
+        """
+        Reports that the rect area of the scratch surface changed.
+        rect: anything pygame accepts as a rect, e.g. ((left, top), (width, height))
+        """
+        rect = pygame.Rect(rect)
+        for k, (_, _, area) in enumerate(self.remap.panels):
+            if area.colliderect(rect):
+                self._manual.add(k)
+
+    def mark_all_dirty(self):
+        self._manual.update(range(len(self.remap.panels)))
+
+    def take_marks(self):
+        """
+        Returns the set of the panels marked since the last call, to be
+        handed over with the frame they belong to
+        """
+        marks, self._manual = self._manual, set()
+        return marks
+
+    def hand_over(self, marks):
+        """
+        Reports the panels marked on the frame about to be drawn, as returned
+        by take_marks. From then on, update only takes the marks handed over.
+        """
+        if self._handed is None:
+            self._handed = set()
+        self._handed.update(marks)
+
+    def _detect(self, scratch):
+        import numpy as np
+        pixels = _pixels(scratch)
+        if self._previous is None or self._previous.shape != pixels.shape:
+            self._previous = np.array(pixels)
+            self._diff = np.empty(pixels.shape, dtype=bool)
+            led_cols = self.remap.led_cols
+            led_rows = self.remap.led_rows
+            self._cols = np.array([area.left//led_cols
+                                   for _, _, area in self.remap.panels])
+            self._rows = np.array([area.top//led_rows
+                                   for _, _, area in self.remap.panels])
+            del pixels
+            return list(range(len(self.remap.panels)))
+        diff = np.not_equal(pixels, self._previous, out=self._diff)
+        self._previous[...] = pixels
+        del pixels
+        width, height = diff.shape[:2]
+        led_cols = self.remap.led_cols
+        led_rows = self.remap.led_rows
+        tiles = diff.reshape((width//led_cols, led_cols, 
+                              height//led_rows, led_rows, -1))
+        changed = tiles.any(axis=(1, 3, 4))
+        return np.flatnonzero(changed[self._cols, self._rows]).tolist()
+
+    def update(self, scratch):
+        """
+        To be called once per frame. Returns the list of indices in 
+        remap.panels of the panels which changed.
+        """
+        self.frame += 1
+        if self._handed is None:
+            changed, self._manual = self._manual, set()
+        else:
+            changed, self._handed = self._handed, set()
+        if self.mode == 'auto':
+            changed.update(self._detect(scratch))
+        changed = sorted(changed)
+        for k in changed:
+            self._stamps[k] = self.frame
+        return changed
+
+    def stale(self):
+        """
+        Returns the list of indices in remap.panels which must be sent to
+        the canvas being prepared for it to show the current frame, and
+        counts the skipped ones.
+        """
+        #the binding wraps the canvas in a new object on each swap, so the
+        #canvases are told apart by the parity of the frame: the one being
+        #prepared was last drawn two frames ago, none on the first two frames
+        since = self.frame-2
+        stale = [k for k, stamp in enumerate(self._stamps) if stamp > since]
+        self.skipped = len(self._stamps) - len(stale)
+        self.total_skipped += self.skipped
+        return stale
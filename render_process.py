@@ -0,0 +1,234 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Multi-process rendering of the murapix frames.
+
+Because of the GIL, the game logic, the drawing and the output to the LED
+panels share a single core of the raspberry pi. With RenderProcess, the game
+(setup, logic_loop and graphics_loop) runs in a forked worker process, while
+the parent process keeps the RGBMatrix, remaps and swaps the frames, and
+handles the signals.
+
+The frames are handed over through a ring of surfaces in shared memory, the
+same way as OutputPipeline does between threads:
+    - the worker copies its self.scratch onto a free surface of the ring and
+      sends its index (with the areas marked dirty and its timings) to the
+      parent,
+    - the parent draws that surface straight from the shared memory, then
+      gives it back to the ring,
+so a surface is never written while being read, and the parent, whose core
+limits the output, makes no copy of the frame. With 2 surfaces or more, the
+worker draws the next frame meanwhile. When the output is slower
+than the game, the worker waits for a free surface.
+
+The worker ignores SIGINT and is terminated with its parent (the kernel sends
+it SIGTERM if the parent dies), so no orphan process is left behind.
+As the worker is forked, this needs linux. Note that the pygame events
+(keyboard, joysticks) are to be read by the game in the worker. Its timings
+(logic, graphics...) are passed on with each frame to the self.stats of the
+parent, which holds the timings of both processes and dumps them.
+"""
+import multiprocessing
+import os
+import signal
+import traceback
+from multiprocessing import shared_memory
+from time import perf_counter
+import pygame
+
+
+#prctl option asking the kernel to signal a process when its parent dies
+PR_SET_PDEATHSIG = 1
+
+
+def _die_with_parent():
+    try:
+        import ctypes
+        ctypes.CDLL(None, use_errno=True).prctl(PR_SET_PDEATHSIG, signal.SIGTERM)
+    except (OSError, AttributeError):
+        #not linux: the worker still checks if its parent is gone when waiting
+        pass
+
+
+class RenderProcess:
+    """
+    murapix: the Murapix instance whose game is run in the worker process
+    draw: function drawing the scratch surface it is given on the output in
+        the parent process, e.g. murapix.backend.draw
+    depth: number of surfaces in the shared ring
+
+    RenderProcess has the following properties:
+        self.frames: the number of frames drawn by the parent process
+        self.error: the traceback of the worker if it failed, else None
+    """
+    def __init__(self, murapix, draw, depth=2):
+        assert depth > 1, "the ring needs at least 2 surfaces"
+        self.murapix = murapix
+        self.draw = draw
+        self.depth = depth
+        self.frames = 0
+        self.error = None
+        self.size = murapix.scratch.get_size()
+        width, height = self.size
+        self._slot_bytes = width*height*4
+        self._memory = shared_memory.SharedMemory(create=True,
+                                                  size=self._slot_bytes*depth)
+        self._slots = [pygame.image.frombuffer(self._memory.buf[k*self._slot_bytes:
+                                                                (k+1)*self._slot_bytes],
+                                               self.size, 'RGBX')
+                       for k in range(depth)]
+        context = multiprocessing.get_context('fork')
+        #plain pipe rather than queues: no lock nor feeder thread, so the
+        #parent can stop it from a signal handler at any time
+        self._connection, self._worker_connection = context.Pipe()
+        #worker side, surfaces of the ring not handed over to the parent
+        self._free = list(range(depth))
+        self._parent = os.getpid()
+        self._marks = []
+        self._process = context.Process(target=self._worker,
+                                        name='murapix-render',
+                                        daemon=True)
+
+    def in_worker(self):
+        return os.getpid() != self._parent
+
+    def start(self):
+        self._process.start()
+        self._worker_connection.close()
+
+    def _worker(self):
+        signal.signal(signal.SIGINT, signal.SIG_IGN)
+        signal.signal(signal.SIGTERM, signal.SIG_DFL)
+        _die_with_parent()
+        #so that the worker sees the pipe closing when the parent stops it
+        self._connection.close()
+        connection = self._worker_connection
+        murapix = self.murapix
+        message = None
+        #the parent records the timings of the worker and dumps them
+        murapix.stats.journal = []
+        murapix.stats_dump = None
+        try:
+            if murapix.gamepads is not None:
+                #threads do not survive the fork
+                murapix.gamepads.start()
+            murapix.start_frame_server()
+            murapix.setup()
+            murapix.run_frames(self.publish)
+        except (SystemExit, EOFError, BrokenPipeError):
+            pass
+        except Exception:
+            message = traceback.format_exc()
+        finally:
+            if murapix.frame_server is not None:
+                murapix.frame_server.stop()
+        try:
+            connection.send(message)
+        except (OSError, EOFError):
+            pass
+
+    def mark_dirty(self, rect):
+        """
+        In the worker, reports that the rect area of scratch changed, to be
+        passed on with the next frame
+        """
+        self._marks.append(tuple(pygame.Rect(rect)))
+
+    def publish(self, scratch=None):
+        """
+        In the worker, hands a copy of scratch (murapix.scratch by default)
+        over to the parent process. Waits for a free surface of the ring if
+        the parent is behind.
+        """
+        murapix = self.murapix
+        if scratch is None:
+            scratch = murapix.scratch
+        connection = self._worker_connection
+        while not self._free or connection.poll():
+            if os.getppid() != self._parent:
+                murapix.RUNNING = False
+                return
+            if connection.poll(0.1):
+                #raises EOFError once the parent stopped
+                self._free.append(connection.recv())
+        k = self._free.pop()
+        self._slots[k].blit(scratch, (0, 0))
+        stats = murapix.stats
+        connection.send((k, self._marks, stats.journal))
+        self._marks = []
+        stats.journal = []
+
+    def serve(self):
+        """
+        In the parent, draws the frames of the worker until it stops or
+        murapix.RUNNING is set to False
+        """
+        murapix = self.murapix
+        stats = murapix.stats
+        connection = self._connection
+        pump_events = murapix.backend.name == 'demo'
+        while murapix.RUNNING:
+            if pump_events:
+                for event in pygame.event.get():
+                    if event.type == pygame.QUIT:
+                        murapix.RUNNING = False
+            if not connection.poll(0.1):
+                if not self._process.is_alive():
+                    print("murapix render process stopped")
+                    break
+                continue
+            try:
+                message = connection.recv()
+            except EOFError:
+                print("murapix render process stopped")
+                break
+            if message is None:
+                break
+            if isinstance(message, str):
+                self.error = message
+                print("Error in murapix render process")
+                print(message)
+                break
+            k, marks, timings = message
+            if murapix.dirty is not None:
+                for rect in marks:
+                    murapix.dirty.mark_dirty(rect)
+            for phase, seconds in timings:
+                #the frame time is the one of the output, recorded below
+                if phase != 'frame':
+                    stats.record(phase, seconds)
+            t0 = perf_counter()
+            self.draw(self._slots[k])
+            try:
+                connection.send(k)
+            except OSError:
+                #the worker is done, its last messages are still to be read
+                pass
+            busy = perf_counter()-t0
+            self.frames += 1
+            stats.end_frame(busy, murapix.fps)
+            murapix.dump_stats(perf_counter())
+
+    def stop(self, timeout=1.0):
+        """
+        In the parent, stops the worker, killing it if it does not stop in
+        time, and frees the shared memory
+        """
+        if self._process is None:
+            return
+        self._connection.close()
+        if self._process.pid is not None:
+            self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.terminate()
+                self._process.join(timeout)
+            if self._process.is_alive():
+                self._process.kill()
+                self._process.join()
+        self._process = None
+        #the surfaces must be gone before the memory they use is released
+        self._slots = []
+        self.murapix.remap.forget()
+        self._memory.close()
+        self._memory.unlink()
+
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Dynamic resolution scaling of murapix games.
+
+When a scene is too heavy for the frame budget, it is better to draw it at
+a lower resolution than to drop frames. ResolutionScaler picks the render
+scale of the next frames from the measured frame times:
+    - the frame times are averaged over window frames,
+    - the scale goes one step down when the average is above high times the
+      frame budget, and one step up when it is below low times the budget
+      and would stay below high times the budget with the pixels of the
+      larger scale,
+    - the average starts again after each change, and these margins keep
+      the scale from going back and forth.
+
+Murapix then has graphics_loop draw on a smaller self.scratch, and upscales
+it with nearest neighbour sampling to the size of the murapix. When nothing
+else needs the full size surface, the upscale is folded into the remap
+table, see PanelRemap.scaled_index, so it costs no extra pass.
+"""
+
+
+def scaled_size(size, scale):
+    """
+    Returns the (width, height) of size at scale, at least 1 pixel each
+    """
+    width, height = size
+    return (max(1, round(width*scale)), max(1, round(height*scale)))
+
+
+class ResolutionScaler:
+    """
+    scales: the render scales, from the full resolution down, e.g.
+        (1, 0.75, 0.5)
+    high: fraction of the frame budget above which the scale goes down
+    low: fraction of the frame budget below which the scale goes up
+    window: number of frames averaged before each decision
+
+    ResolutionScaler has the following properties:
+        self.scale: the current render scale
+        self.level: the index of self.scale in scales
+        self.changes: the number of times the scale changed
+    """
+    def __init__(self, scales=(1., .75, .5), high=.9, low=.6, window=30):
+        assert scales and all(0 < s <= 1 for s in scales), "scales must be in (0, 1]"
+        assert list(scales) == sorted(scales, reverse=True), "scales must go down"
+        assert 0 < low < high, "low must be lower than high"
+        self.scales = tuple(scales)
+        self.high = high
+        self.low = low
+        self.window = window
+        self.level = 0
+        self.scale = self.scales[0]
+        self.changes = 0
+        self._total = 0.
+        self._count = 0
+
+    def update(self, busy, budget):
+        """
+        busy: time in seconds spent working on the last frame
+        budget: the frame budget in seconds, i.e. 1/fps
+
+        Returns True if the scale changed.
+        """
+        self._total += busy
+        self._count += 1
+        if self._count < self.window or not budget:
+            return False
+        mean = self._total/self._count
+        self._total = 0.
+        self._count = 0
+        level = self.level
+        if mean > self.high*budget and level < len(self.scales)-1:
+            level += 1
+        elif (mean < self.low*budget and level > 0
+              #at worst, the time grows with the number of pixels
+              and mean*(self.scales[level-1]/self.scale)**2 < self.high*budget):
+            level -= 1
+        else:
+            return False
+        self.level = level
+        self.scale = self.scales[level]
+        self.changes += 1
+        return True
@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Fixed timestep scheduling of murapix games.
+
+With clock.tick(fps), the game logic runs once per rendered frame, so a slow
+output slows the game itself down. FixedStepScheduler runs the logic at a
+fixed rate, independently of the render rate:
+    - the logic steps are run every 1/logic_rate seconds, catching up with
+      at most max_catchup steps at once when late,
+    - the frames are rendered at most render_rate times per second, and are
+      skipped (at most max_skip in a row) while the logic is behind,
+    - the render gets the interpolation alpha, i.e. the fraction of a logic
+      step elapsed since the last one, to draw in between two logic states,
+    - waiting is done by sleeping until shortly before the deadline and
+      spinning the rest of the time, as sleep alone is not precise enough.
+
+It only needs callables, so it can be reused by a rewritten Murapix.run.
+"""
+import time
+from time import perf_counter
+
+
+def sleep_until(deadline, spin=0.002):
+    """
+    Waits until perf_counter() reaches deadline. Sleeps until spin seconds
+    before the deadline, then busy-waits.
+    """
+    remaining = deadline-perf_counter()
+    if remaining > spin:
+        time.sleep(remaining-spin)
+    while perf_counter() < deadline:
+        pass
+
+
+class FixedStepScheduler:
+    """
+    logic_rate: number of logic steps per second
+    render_rate: maximum number of rendered frames per second, None to
+        render whenever the logic is up to date
+    max_catchup: maximum number of logic steps run at once when late
+    max_skip: maximum number of renders skipped in a row while late
+    spin: seconds of busy-waiting before each deadline
+
+    FixedStepScheduler has the following properties:
+        self.steps: the number of logic steps run
+        self.frames: the number of frames rendered
+        self.skipped: the number of renders skipped because the logic was late
+        self.dropped: the number of logic steps dropped because the logic was
+            too late to catch up
+    """
+    def __init__(self, logic_rate, render_rate=None, max_catchup=5,
+                 max_skip=5, spin=0.002):
+        assert logic_rate > 0, "logic_rate must be positive"
+        self.logic_rate = logic_rate
+        self.render_rate = render_rate
+        self.max_catchup = max_catchup
+        self.max_skip = max_skip
+        self.spin = spin
+        self.steps = 0
+        self.frames = 0
+        self.skipped = 0
+        self.dropped = 0
+
+    def run(self, running, step, render, stats=None):
+        """
+        running: callable returning False to stop the loop
+        step: callable running one logic step
+        render: callable taking the interpolation alpha in [0, 1), rendering
+            and outputing a frame
+        stats: optional FrameStats to record the idle time in
+        """
+        step_time = 1/self.logic_rate
+        render_time = 1/self.render_rate if self.render_rate else 0.
+        previous = perf_counter()
+        next_render = previous
+        lag = 0.
+        skips = 0
+        while running():
+            now = perf_counter()
+            lag += now-previous
+            previous = now
+
+            steps = 0
+            while lag >= step_time and steps < self.max_catchup:
+                step()
+                lag -= step_time
+                steps += 1
+            self.steps += steps
+
+            if lag >= step_time:
+                #still behind: skip rendering to catch up, but not forever
+                if skips < self.max_skip:
+                    skips += 1
+                    self.skipped += 1
+                    continue
+                dropped = int(lag/step_time)
+                self.dropped += dropped
+                lag -= dropped*step_time
+
+            now = perf_counter()
+            if now >= next_render:
+                render(lag/step_time)
+                self.frames += 1
+                skips = 0
+                next_render += render_time
+                if next_render < now:
+                    next_render = now+render_time
+
+            if not running():
+                break
+            #wait for the next logic step or the next render
+            deadline = previous-lag+step_time
+            if render_time:
+                deadline = min(deadline, max(next_render, previous))
+            t0 = perf_counter()
+            sleep_until(deadline, self.spin)
+            if stats is not None:
+                stats.record('idle', perf_counter()-t0)
@@ -28,19 +28,21 @@ pc = pick_color(some_pal)
 class Screen_Test(Murapix):
     def setup(self):
         self.ticks = 0
-        scratch = self.scratch
+        #the colored panels are drawn once, the test is drawn over them
+        background = self.add_layer('background', static=True, transparent=False)
+        self.test = self.add_layer('test')
+        scratch = background.surface
         mapping = self.mapping
         led_rows = self.led_rows
-        font = pygame.font.Font(None, led_rows//4)
+        led_cols = self.led_cols
+        text = self.text
         for i, n in enumerate(mapping):#rows
             for j, m in enumerate(n):#columns
-                pygame.draw.rect(scratch,pygame.Color(next(pc)),[led_rows*j,led_rows*i,led_rows,led_rows])
+                pygame.draw.rect(scratch,pygame.Color(next(pc)),[led_cols*j,led_rows*i,led_cols,led_rows])
                 if m is None:
-                    text = font.render("X",False,(0,0,0))
+                    text.draw(scratch,"X",(led_cols*j,led_rows*i),led_rows//4,(0,0,0))
                 else:
-                    text = font.render(str(m),False,(0,0,0))
-                
-                scratch.blit(text,(led_rows*j,led_rows*i))
+                    text.draw(scratch,str(m),(led_cols*j,led_rows*i),led_rows//4,(0,0,0))
         
     
     def logic_loop(self):
@@ -51,32 +53,34 @@ class Screen_Test(Murapix):
                 pygame.quit()
                 sys.exit()
         led_rows = self.led_rows
+        led_cols = self.led_cols
         if self.ticks % 100 == 0:
           self.current_image = randint(1,self.max_number_of_panels)
           self.current_color = pygame.Color(next(pc))
-          self.text_pos = [choice([0,led_rows//4, led_rows//2, 3*led_rows//4]),
+          self.text_pos = [choice([0,led_cols//4, led_cols//2, 3*led_cols//4]),
                            choice([0,led_rows//4, led_rows//2, 3*led_rows//4])]
           self.ticks=0
         self.ticks += 1
     def graphics_loop(self):   
-        scratch = self.scratch
+        test = self.test
+        scratch = test.surface
         mapping = self.mapping
         led_rows = self.led_rows
+        led_cols = self.led_cols
         text_pos = self.text_pos
-        font = pygame.font.Font(None, 16)     
         for i, n in enumerate(mapping):#rows
             for j, m in enumerate(n):#columns
                 if m != self.current_image:
                     continue
-                pygame.draw.rect(scratch,
-                                 (0,0,0),
-                                 [led_rows*j,led_rows*i,led_rows,led_rows])
+                test.mark_dirty(pygame.draw.rect(scratch,
+                                                 (0,0,0),
+                                                 [led_cols*j,led_rows*i,led_cols,led_rows]))
                 pygame.draw.rect(scratch,
                                  self.current_color,
-                                 [led_rows*j,led_rows*i,led_rows,round(led_rows*self.ticks/100)])
-                text = font.render(str(m),False,(0,0,0))
-                
-                scratch.blit(text,(led_rows*j+text_pos[0],led_rows*i+text_pos[1]))
+                                 [led_cols*j,led_rows*i,led_cols,round(led_rows*self.ticks/100)])
+                test.mark_dirty(self.text.draw_glyphs(scratch,str(m),
+                                                      (led_cols*j+text_pos[0],led_rows*i+text_pos[1]),
+                                                      16,(0,0,0)))
 
 
 def main():
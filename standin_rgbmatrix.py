@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Stand-in for hzeller rgbmatrix python binding.
+
+It has the same API as the parts of rgbmatrix used by murapix, without any
+hardware behind it, and records what the canvases receive. Use it to run
+the murapix LED output path on any linux machine, e.g.:
+    import sys, standin_rgbmatrix
+    sys.modules['rgbmatrix'] = standin_rgbmatrix
+
+FrameCanvas.received keeps the last HISTORY calls as tuples of
+(method name, (offset_x, offset_y), (width, height), pixel bytes).
+
+As the binding wraps the C++ canvas in a new FrameCanvas object on each
+call, RGBMatrix.SwapOnVSync returns a new object sharing the state of the
+canvas previously shown: canvases are not to be told apart by identity.
+"""
+from collections import deque
+
+
+HISTORY = 8
+
+
+class RGBMatrixOptions:
+    def __init__(self):
+        self.rows = 32
+        self.cols = 32
+        self.chain_length = 1
+        self.parallel = 1
+        self.hardware_mapping = 'regular'
+        self.brightness = 100
+        self.drop_privileges = 1
+
+
+class FrameCanvas:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.received = deque(maxlen=HISTORY)
+        self.count = 0
+
+    def SetImage(self, image, offset_x=0, offset_y=0, unsafe=True):
+        if image.mode != "RGB":
+            raise Exception("Currently, only RGB mode is supported for SetImage().")
+        self.count += 1
+        if self.received.maxlen:
+            self.received.append(('SetImage', (offset_x, offset_y),
+                                  image.size, image.tobytes()))
+
+    def Clear(self):
+        self.count += 1
+        self.received.append(('Clear', (0, 0), (self.width, self.height), b''))
+
+
+class BufferFrameCanvas(FrameCanvas):
+    """
+    FrameCanvas of a binding exposing a buffer entry point,
+    see remap.ChainFrame
+    """
+    def SetImageBuffer(self, buffer, width, height):
+        self.count += 1
+        if self.received.maxlen:
+            self.received.append(('SetImageBuffer', (0, 0),
+                                  (width, height), bytes(buffer)))
+
+
+def _wrap(canvas):
+    """
+    Returns a new FrameCanvas object sharing the state of canvas
+    """
+    wrapper = object.__new__(type(canvas))
+    wrapper.__dict__ = canvas.__dict__
+    return wrapper
+
+
+class RGBMatrix:
+    """
+    canvas_class may be set to BufferFrameCanvas to emulate a binding with a
+    buffer entry point.
+    """
+    canvas_class = FrameCanvas
+
+    def __init__(self, options=None):
+        if options is None:
+            options = RGBMatrixOptions()
+        self.options = options
+        self.width = options.cols*options.chain_length
+        self.height = options.rows*options.parallel
+        self.brightness = options.brightness
+        self.swaps = 0
+        self._front = self.canvas_class(self.width, self.height)
+
+    def CreateFrameCanvas(self):
+        return self.canvas_class(self.width, self.height)
+
+    def SwapOnVSync(self, canvas, framerate_fraction=1):
+        self.swaps += 1
+        previous, self._front = self._front, canvas
+        return _wrap(previous)
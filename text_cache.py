@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Cached text rendering for murapix games.
+
+Loading a font and rendering a string are by far the slowest things a game
+usually does each frame, while the same strings keep being rendered again
+and again. TextCache keeps:
+    - the pygame fonts, by (name, size),
+    - the rendered surfaces, by (font, text, color, background, antialias),
+      in a bounded least recently used cache counting its hits and misses,
+    - glyph atlases, i.e. each character rendered once, for text changing
+      every frame such as scores and clocks: draw_glyphs composes it from
+      the cached characters in a single blits call, so a new score costs no
+      rendering at all.
+"""
+from collections import OrderedDict
+import pygame
+
+
+#characters of the glyph atlases by default
+DIGITS = '0123456789:.,-+/% '
+
+
+def _color_key(color):
+    if color is None:
+        return None
+    return tuple(pygame.Color(color))
+
+
+class TextCache:
+    """
+    max_surfaces: maximum number of rendered surfaces kept
+
+    TextCache has the following properties:
+        self.hits: the number of renders served from the cache
+        self.misses: the number of renders actually done
+        self.evictions: the number of surfaces dropped to make room
+    """
+    def __init__(self, max_surfaces=256):
+        assert max_surfaces > 0, "max_surfaces must be positive"
+        self.max_surfaces = max_surfaces
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._fonts = {}
+        self._surfaces = OrderedDict()
+        self._atlases = {}
+
+    def font(self, size, name=None):
+        """
+        Returns the pygame font of name (a path to a font file, None for
+        the default font) and size, loaded once
+        """
+        key = (name, size)
+        font = self._fonts.get(key)
+        if font is None:
+            if not pygame.font.get_init():
+                pygame.font.init()
+            font = self._fonts[key] = pygame.font.Font(name, size)
+        return font
+
+    def render(self, text, size, color=(255, 255, 255), background=None,
+               antialias=False, name=None):
+        """
+        Same as pygame.font.Font(name, size).render(text, antialias, color,
+        background), the surface being cached. The surface returned must
+        not be drawn on.
+        """
+        key = (name, size, text, _color_key(color), _color_key(background),
+               antialias)
+        surfaces = self._surfaces
+        surface = surfaces.get(key)
+        if surface is not None:
+            surfaces.move_to_end(key)
+            self.hits += 1
+            return surface
+        self.misses += 1
+        if background is None:
+            surface = self.font(size, name).render(text, antialias, color)
+        else:
+            surface = self.font(size, name).render(text, antialias, color,
+                                                   background)
+        surfaces[key] = surface
+        if len(surfaces) > self.max_surfaces:
+            surfaces.popitem(last=False)
+            self.evictions += 1
+        return surface
+
+    def draw(self, surface, text, position, size, color=(255, 255, 255),
+             background=None, antialias=False, name=None):
+        """
+        Blits the cached rendering of text on surface at position, returns
+        the pygame.Rect drawn
+        """
+        return surface.blit(self.render(text, size, color, background,
+                                        antialias, name),
+                            position)
+
+    def _atlas(self, size, color, background, antialias, name, characters):
+        key = (name, size, _color_key(color), _color_key(background),
+               antialias, characters)
+        atlas = self._atlases.get(key)
+        if atlas is None:
+            font = self.font(size, name)
+            glyphs = {}
+            for character in characters:
+                if background is None:
+                    glyph = font.render(character, antialias, color)
+                else:
+                    glyph = font.render(character, antialias, color, background)
+                glyphs[character] = glyph
+            atlas = self._atlases[key] = (glyphs, font.get_height())
+        return atlas
+
+    def draw_glyphs(self, surface, text, position, size,
+                    color=(255, 255, 255), background=None, antialias=False,
+                    name=None, characters=DIGITS):
+        """
+        Blits text on surface at position, character by character from the
+        glyph atlas of characters (the digits and the usual separators by
+        default), rendered once for each font and color. Meant for text
+        changing every frame, e.g. scores and clocks. Characters missing
+        from the atlas are rendered through the cache.
+        Returns the pygame.Rect drawn.
+        """
+        glyphs, height = self._atlas(size, color, background, antialias,
+                                     name, characters)
+        left, top = position
+        x = left
+        sequence = []
+        for character in text:
+            glyph = glyphs.get(character)
+            if glyph is None:
+                glyph = self.render(character, size, color, background,
+                                    antialias, name)
+            sequence.append((glyph, (x, top)))
+            x += glyph.get_width()
+        surface.blits(sequence, False)
+        return pygame.Rect(left, top, x-left, height)
+
+    def size(self, text, size, name=None):
+        """
+        Returns the (width, height) text would take, without rendering it
+        """
+        return self.font(size, name).size(text)
+
+    def stats(self):
+        """
+        Returns a dict with the hits, misses, evictions, number of cached
+        surfaces and hit rate of the cache
+        """
+        total = self.hits+self.misses
+        return {'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'surfaces': len(self._surfaces),
+                'fonts': len(self._fonts),
+                'atlases': len(self._atlases),
+                'hit rate': self.hits/total if total else 0.}
+
+    def clear(self):
+        self._surfaces.clear()
+        self._atlases.clear()
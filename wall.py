@@ -0,0 +1,388 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Murapix walls driven by several controllers.
+
+A raspberry pi drives at most 3 parallel chains. A larger wall is described
+by a single config file, whose mapping spans all the panels, plus a 'nodes'
+section listing the controllers (the nodes), e.g.:
+    [nodes]
+    split = rows
+    node1 = 192.168.1.11:5601
+    node2 = 192.168.1.12:5601
+
+The mapping is split in as many bands of panel rows (or columns with
+split = cols) as there are nodes, balancing the number of panels. Each node
+drives its band as a murapix of its own: its panels are numbered in the
+order of the wall mapping, and its parallel setting is the largest of 3, 2
+and 1 dividing its number of panels.
+
+The game runs on the coordinator with the "wall" backend. Each frame, the
+band of each node (or only the panels which changed, with dirty detection)
+is sent to it over TCP, see frame_server.py. The frames are shown in
+lockstep with a swap barrier: each node prepares its canvas and answers
+when ready, and once all nodes are ready the coordinator tells them all to
+swap.
+
+How to use:
+    on each node:        python3 wall.py wall.ini --node=1 [--demo=3]
+    on the coordinator:  python3 game.py wall.ini --backend=wall
+
+For tests, the nodes can all run on the same machine, e.g. with
+node1 = 127.0.0.1:5601, node2 = 127.0.0.1:5602 and --backend=null.
+"""
+from configparser import ConfigParser
+import os
+import socket
+import sys
+import tempfile
+import time
+from time import perf_counter
+import pygame
+try:
+    from .murapix import Murapix, get_config, get_orientation
+    from .frame_server import (FrameSender, parse_address, HEADER, MAGIC, END,
+                               SWAP, ACK, ACK_MAGIC, TCP_PACKET, SEQ_MASK)
+except (ImportError, SystemError) as e:#if doing screen test
+    from murapix import Murapix, get_config, get_orientation
+    from frame_server import (FrameSender, parse_address, HEADER, MAGIC, END,
+                              SWAP, ACK, ACK_MAGIC, TCP_PACKET, SEQ_MASK)
+
+
+def get_nodes_config(configfile):
+    """
+    configfile: path to a .ini file with the murapix configuration
+
+    returns the split ("rows" or "cols") and the list of the addresses of
+    the nodes of the 'nodes' section, in the order of their number
+    """
+    config = ConfigParser()
+    config.read(configfile)
+    if not config.has_section('nodes'):
+        raise ValueError(configfile+" should have a [nodes] section listing the nodes of the wall")
+    split = config.get('nodes', 'split', fallback='rows')
+    if split not in ('rows', 'cols'):
+        raise ValueError('split must be "rows" or "cols". {} was entered'.format(split))
+    nodes = []
+    for key, address in config.items('nodes'):
+        if key.startswith('node'):
+            try:
+                nodes.append((int(key[4:]), address.strip()))
+            except ValueError:
+                raise ValueError('nodes must be named node1, node2... {} was entered'.format(key))
+    numbers = sorted(n for n, _ in nodes)
+    if numbers != list(range(1, len(nodes)+1)):
+        raise ValueError('nodes must be numbered from 1 to the number of nodes')
+    return split, [address for _, address in sorted(nodes)]
+
+
+def _partition(counts, parts):
+    """
+    Returns the end index of each of the parts contiguous groups of counts
+    minimizing the largest sum of a group
+    """
+    n = len(counts)
+    prefix = [0]
+    for c in counts:
+        prefix.append(prefix[-1]+c)
+    #best[p][i]: (largest sum, ends) splitting the first i counts in p groups
+    best = [[None]*(n+1) for _ in range(parts+1)]
+    best[0][0] = (0, [])
+    for p in range(1, parts+1):
+        for i in range(p, n+1):
+            candidates = []
+            for j in range(p-1, i):
+                if best[p-1][j] is None:
+                    continue
+                worst, ends = best[p-1][j]
+                candidates.append((max(worst, prefix[i]-prefix[j]), ends+[i]))
+            if candidates:
+                best[p][i] = min(candidates, key=lambda c: c[0])
+    return best[parts][n][1]
+
+
+def shard_mapping(mapping, count, split='rows'):
+    """
+    mapping: list of lists of the wall, as returned by get_config
+    count: number of nodes
+    split: "rows" to give each node a band of panel rows, "cols" for columns
+
+    returns for each node a dict with:
+        mapping: the mapping of its band, its panels renumbered from 1 in
+            the order of the wall mapping
+        origin: (column, row) of the band in the wall mapping, in panels
+        numbers: dict of wall panel number: node panel number
+        parallel: the number of parallel chains of the node
+    """
+    rows = len(mapping)
+    cols = len(mapping[0])
+    lines = rows if split == 'rows' else cols
+    if count > lines:
+        raise ValueError('Cannot split {} {} between {} nodes'.format(lines, split, count))
+    if split == 'rows':
+        line = lambda i: mapping[i]
+    else:
+        line = lambda i: [mapping[r][i] for r in range(rows)]
+    counts = [sum(m is not None for m in line(i)) for i in range(lines)]
+    shards = []
+    start = 0
+    for end in _partition(counts, count):
+        if split == 'rows':
+            band = [list(mapping[i]) for i in range(start, end)]
+            origin = (0, start)
+        else:
+            band = [list(mapping[r][start:end]) for r in range(rows)]
+            origin = (start, 0)
+        panels = sorted(m for n in band for m in n if m is not None)
+        if not panels:
+            raise ValueError('Node {} would have no panel'.format(len(shards)+1))
+        numbers = {m: k+1 for k, m in enumerate(panels)}
+        band = [[None if m is None else numbers[m] for m in n] for n in band]
+        parallel = max(p for p in (3, 2, 1) if len(panels) % p == 0)
+        shards.append({'mapping': band, 'origin': origin,
+                       'numbers': numbers, 'parallel': parallel})
+        start = end
+    return shards
+
+
+def node_config(configfile, shard):
+    """
+    Returns the ConfigParser of the murapix of a node: the 'matrix' section
+    of configfile, with the mapping, parallel and orientation of the shard
+    """
+    config = ConfigParser()
+    config.read(configfile)
+    node = ConfigParser()
+    node.add_section('matrix')
+    for key, value in config.items('matrix'):
+        node.set('matrix', key, value)
+    node.set('matrix', 'mapping', '\n'.join(', '.join('.' if m is None else str(m)
+                                                      for m in n)
+                                            for n in shard['mapping']))
+    node.set('matrix', 'parallel', str(shard['parallel']))
+    orientation = get_orientation(configfile)
+    node.remove_option('matrix', 'orientation')
+    orientation = ['{}: {}'.format(shard['numbers'][panel], name)
+                   for panel, name in sorted(orientation.items())
+                   if panel in shard['numbers']]
+    if orientation:
+        node.set('matrix', 'orientation', ', '.join(orientation))
+    return node
+
+
+def _band_rects(configfile):
+    mapping, _, _, _, led_rows, led_cols, _ = get_config(configfile)
+    split, addresses = get_nodes_config(configfile)
+    shards = shard_mapping(mapping, len(addresses), split)
+    rects = []
+    for shard in shards:
+        col, row = shard['origin']
+        rects.append(pygame.Rect(col*led_cols, row*led_rows,
+                                 len(shard['mapping'][0])*led_cols,
+                                 len(shard['mapping'])*led_rows))
+    return addresses, shards, rects
+
+
+def _tcp(address):
+    protocol, host, port = parse_address(address)
+    return 'tcp:{}:{}'.format(host, port)
+
+
+class WallCoordinator:
+    """
+    Sends the frames of the coordinator to the nodes, see the "wall" backend
+
+    configfile: path to the .ini file of the wall, with its 'nodes' section
+    timeout: seconds to wait for the nodes to be up, and for each of them
+        to be ready to swap
+
+    WallCoordinator has the following properties:
+        self.rects: the pygame.Rect of the wall scratch surface driven by
+            each node
+        self.frames: the number of frames shown
+    """
+    def __init__(self, configfile, timeout=10.):
+        addresses, self.shards, self.rects = _band_rects(configfile)
+        self.timeout = timeout
+        self.frames = 0
+        self.senders = []
+        for address, rect in zip(addresses, self.rects):
+            self.senders.append(self._connect(address, rect.size))
+
+    def _connect(self, address, size):
+        deadline = perf_counter()+self.timeout
+        while True:
+            try:
+                sender = FrameSender(_tcp(address), size)
+                break
+            except ConnectionError:
+                if perf_counter() > deadline:
+                    raise
+                time.sleep(0.1)
+        sender._socket.settimeout(self.timeout)
+        return sender
+
+    def present(self, scratch, areas=None, stats=None):
+        """
+        Sends the band of each node, waits for all of them to be ready, and
+        makes them swap.
+
+        areas: pygame.Rect of the areas of scratch which changed, by default
+            the whole bands are sent
+        stats: optional FrameStats to record the send and barrier times in
+        """
+        t0 = perf_counter()
+        for sender, rect in zip(self.senders, self.rects):
+            band = scratch.subsurface(rect)
+            if areas is None:
+                sender.send_frame(band)
+            else:
+                sender.send_tiles(band, [area.clip(rect).move(-rect.left, -rect.top)
+                                         for area in areas if area.colliderect(rect)])
+        t1 = perf_counter()
+        for node, sender in enumerate(self.senders):
+            seq = sender.wait_ack()
+            if seq != (sender.seq-1) & SEQ_MASK:
+                raise ConnectionError("node {} is out of step".format(node+1))
+        t2 = perf_counter()
+        for sender in self.senders:
+            sender.send_swap()
+        self.frames += 1
+        if stats is not None:
+            stats.record('send', t1-t0)
+            stats.record('barrier', t2-t1)
+
+    def close(self):
+        for sender in self.senders:
+            sender.close()
+        self.senders = []
+
+
+def _read_exactly(connection, view, running):
+    received = 0
+    while received < len(view):
+        if not running():
+            return False
+        try:
+            n = connection.recv_into(view[received:])
+        except socket.timeout:
+            continue
+        if not n:
+            return False
+        received += n
+    return True
+
+
+class WallNode(Murapix):
+    """
+    A node of a wall, showing its band of the frames of the coordinator.
+    Takes the config file of the wall and --node=NUMBER on the command line,
+    as well as the usual --demo and --backend.
+    """
+    def __init__(self, argv=None):
+        if argv is None:
+            argv = sys.argv
+        node = None
+        murapix_argv = []
+        for arg in argv:
+            if arg.startswith('--node='):
+                node = int(arg.split('=', 1)[1])
+            else:
+                murapix_argv.append(arg)
+        assert node is not None, "needs the number of the node, e.g. --node=1"
+        configfile = [arg for arg in murapix_argv[1:] if not arg.startswith('--')][0]
+        addresses, shards, rects = _band_rects(configfile)
+        if not 1 <= node <= len(addresses):
+            raise ValueError('node must be from 1 to {}'.format(len(addresses)))
+        handle, path = tempfile.mkstemp(suffix='.ini', prefix='murapix-node')
+        try:
+            with os.fdopen(handle, 'w') as f:
+                node_config(configfile, shards[node-1]).write(f)
+            murapix_argv = [path if arg == configfile else arg for arg in murapix_argv]
+            super(WallNode, self).__init__(murapix_argv)
+        finally:
+            os.remove(path)
+        self.node = node
+        self.address = _tcp(addresses[node-1])
+        #only the tiles received are remapped and sent to the panels
+        self.dirty_detection = 'manual'
+
+    def run(self):
+        self.start_dirty_detection()
+        _, _, port = parse_address(self.address)
+        listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        listener.bind(('0.0.0.0', port))
+        listener.listen(1)
+        listener.settimeout(0.1)
+        print('Node {} waiting for the coordinator on port {}'.format(self.node, port))
+        try:
+            while self.RUNNING:
+                self.pump_events()
+                try:
+                    connection, _ = listener.accept()
+                except socket.timeout:
+                    continue
+                connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                connection.settimeout(0.1)
+                with connection:
+                    self.serve(connection)
+        finally:
+            listener.close()
+        self.close()
+
+    def pump_events(self):
+        if self.backend.name == 'demo':
+            for event in pygame.event.get():
+                if event.type == pygame.QUIT:
+                    self.RUNNING = False
+
+    def serve(self, connection):
+        """
+        Shows the frames of the coordinator until it disconnects
+        """
+        if self.backend.name == 'hzeller':
+            #the canvas is ready before answering, only the swap is left
+            prepare = self.prepare_murapix
+            present = self.swap_murapix
+        else:
+            prepare = lambda: None
+            present = self.backend.draw
+        width, height = self.width, self.height
+        packet = bytearray(HEADER.size+max(TCP_PACKET, width*3))
+        view = memoryview(packet)
+        running = lambda: self.RUNNING
+        stats = self.stats
+        t0 = perf_counter()
+        while self.RUNNING:
+            if not _read_exactly(connection, view[:HEADER.size], running):
+                break
+            magic, flags, _, seq, _, x, y, w, h = HEADER.unpack_from(view)
+            length = HEADER.size+w*h*3
+            if magic != MAGIC or length > len(view) or x+w > width or y+h > height:
+                print("Unexpected message from the coordinator")
+                break
+            if flags & SWAP:
+                present()
+                t1 = perf_counter()
+                stats.end_frame(t1-t0, self.fps)
+                t0 = t1
+                self.pump_events()
+                continue
+            if not _read_exactly(connection, view[HEADER.size:length], running):
+                break
+            if w and h:
+                tile = pygame.image.frombuffer(view[HEADER.size:length], (w, h), 'RGB')
+                self.scratch.blit(tile, (x, y))
+                self.mark_dirty((x, y, w, h))
+            if flags & END:
+                prepare()
+                connection.sendall(ACK.pack(ACK_MAGIC, seq))
+
+
+def main():
+
+  WallNode().run()
+
+if __name__ == '__main__':
+  main()